@@ -0,0 +1,163 @@
+"""
+Module Description: This module benchmarks convolution.filtering and tracks
+performance regressions against a stored baseline.
+
+Usage (from the repository root):
+    python -m convolution.benchmarks.benchmark_filtering --output results.json
+    python -m convolution.benchmarks.benchmark_filtering --baseline results.json --threshold 1.25
+
+The second run exits with status 1 if any case got slower than
+threshold times its baseline time.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import time
+import numpy as np
+from convolution.filtering.filtering import apply_filter, pad_image
+from convolution.filtering.helpers import roberts_cross_1_kernel
+
+DEFAULT_SIZES = [64, 256, 1024, 4096]
+DEFAULT_KERNEL_SIZES = [2, 3, 5, 9, 15]
+DEFAULT_CHANNELS = [1, 3]
+DEFAULT_DTYPES = ['uint8', 'float64']
+DEFAULT_THRESHOLD = 1.25
+
+
+def benchmark_kernel(kernel_size: int) -> np.array:
+    """
+    Returns the kernel used for the given size: the 2x2 Roberts cross,
+    otherwise a normalized binomial (Gaussian) kernel.
+    """
+    if kernel_size == 2:
+        return roberts_cross_1_kernel
+    binomial = np.array([math.comb(kernel_size - 1, i) for i in range(kernel_size)], dtype=float)
+    return np.outer(binomial, binomial) / binomial.sum() ** 2
+
+
+def benchmark_image(size: int, channels: int, dtype: str) -> np.array:
+    """
+    Returns a reproducible random image of the given size, channels and dtype.
+    """
+    shape = (size, size) if channels == 1 else (size, size, channels)
+    return np.random.default_rng(size).integers(0, 256, shape).astype(dtype)
+
+
+def time_call(repeats: int, function, *args) -> float:
+    """
+    Returns the best wall time in seconds out of repeats calls of function(*args).
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_cases(sizes, kernel_sizes, channels, dtypes) -> list:
+    """
+    Returns one case dict for every combination of the parameters.
+    """
+    return [{'size': size, 'kernel_size': kernel_size, 'channels': channel_count, 'dtype': dtype}
+            for size, kernel_size, channel_count, dtype in itertools.product(sizes, kernel_sizes, channels, dtypes)]
+
+
+def run_benchmarks(cases: list, methods, repeats: int = 3) -> list:
+    """
+    Times pad_image and apply_filter with each of the methods for every
+    case and returns one result dict per timing.
+    """
+    results = []
+    for case in cases:
+        image = benchmark_image(case['size'], case['channels'], case['dtype'])
+        kernel = benchmark_kernel(case['kernel_size'])
+        calls = [('pad_image', None, (pad_image, image, case['kernel_size']))]
+        calls += [('apply_filter', method, (apply_filter, image, kernel, method)) for method in methods]
+        for function, method, call in calls:
+            try:
+                seconds = time_call(repeats, *call)
+            except ValueError:  # the backend does not apply to this case
+                continue
+            results.append(dict(case, function=function, method=method, seconds=seconds,
+                                megapixels_per_second=case['size'] ** 2 / seconds / 1e6))
+    return results
+
+
+def case_key(result: dict) -> tuple:
+    """
+    Returns the parameters identifying a benchmark case.
+    """
+    return tuple(result[name] for name in ['function', 'method', 'size', 'kernel_size', 'channels', 'dtype'])
+
+
+def compare(results: list, baseline: list, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """
+    Returns the cases which got slower than threshold times their time
+    in the baseline, with the slowdown ratio added. Cases missing in the
+    baseline are skipped.
+    """
+    reference = {case_key(result): result['seconds'] for result in baseline}
+    regressions = []
+    for result in results:
+        if case_key(result) in reference:
+            ratio = result['seconds'] / reference[case_key(result)]
+            if ratio > threshold:
+                regressions.append(dict(result, slowdown=ratio))
+    return regressions
+
+
+def environment() -> dict:
+    """
+    Returns the facts about the machine needed to interpret the timings.
+    """
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+def parse_arguments(argv=None) -> argparse.Namespace:
+    """
+    Parses the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--kernel-sizes', type=int, nargs='+', default=DEFAULT_KERNEL_SIZES)
+    parser.add_argument('--channels', type=int, nargs='+', default=DEFAULT_CHANNELS)
+    parser.add_argument('--dtypes', nargs='+', default=DEFAULT_DTYPES)
+    parser.add_argument('--methods', nargs='+', default=['auto'])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file with stored results to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown ratio against the baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    """
+    Runs the benchmarks, stores and compares them, returns the exit status.
+    """
+    args = parse_arguments(argv)
+    cases = benchmark_cases(args.sizes, args.kernel_sizes, args.channels, args.dtypes)
+    results = run_benchmarks(cases, args.methods, args.repeats)
+    for result in results:
+        print(f"{result['function']:<12} {str(result['method']):<9} {result['size']:>5}px k={result['kernel_size']:<2} "
+              f"c={result['channels']} {result['dtype']:<7} {result['seconds'] * 1e3:10.2f} ms")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'environment': environment(), 'results': results}, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file)['results'], args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {case_key(regression)}: {regression["slowdown"]:.2f}x slower')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
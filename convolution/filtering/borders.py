@@ -0,0 +1,89 @@
+"""
+Module Description: This module contains convolution with reflect, replicate
+and wrap borders. Only the border strips are gathered with their halo,
+the interior is computed from window views of the image itself, so no
+padded copy of the whole image is ever made.
+"""
+import numpy as np
+from convolution.filtering import filtering
+from convolution.filtering.filtering import apply_filter, resolve_method, rows_correlator
+
+BORDER_MODES = ['zero', 'reflect', 'replicate', 'wrap']
+
+
+def border_indices(size: int, before: int, after: int, mode: str) -> np.array:
+    """
+    This function returns for every position along an axis padded by
+    before and after the image position it takes its value from:
+    'reflect' mirrors at the edge pixel (d c b | a b c d | c b a, as
+    numpy.pad 'reflect' and OpenCV BORDER_REFLECT_101), 'replicate'
+    repeats the edge pixel and 'wrap' continues from the opposite edge.
+    """
+    positions = np.arange(-before, size + after)
+    if mode == 'replicate':
+        return np.clip(positions, 0, size - 1)
+    if mode == 'wrap':
+        return positions % size
+    if mode == 'reflect':
+        period = max(2 * (size - 1), 1)
+        positions = np.abs(positions) % period
+        return np.where(positions >= size, period - positions, positions)
+    raise ValueError(f"Unknown border mode '{mode}'.")
+
+
+def border_strips(image_shape, kernel_size: int) -> list:
+    """
+    This function returns the (top, bottom, left, right) output bounds of
+    the strips whose windows reach over the image border: the full-width
+    top and bottom strips, then the left and right strips between them.
+    """
+    before = int(np.ceil((kernel_size - 1) / 2))
+    after = kernel_size - 1 - before
+    height, width = image_shape[:2]
+    top, left = min(before, height), min(before, width)
+    bottom, right = max(height - after, top), max(width - after, left)
+    return [(0, top, 0, width), (bottom, height, 0, width), (top, bottom, 0, left), (top, bottom, right, width)]
+
+
+def read_border_tile(image: np.array, bounds: tuple, kernel_size: int, mode: str) -> np.array:
+    """
+    This function gathers the tile given by bounds together with its
+    halo, the part of the halo outside the image is filled by the mode.
+    """
+    top, bottom, left, right = bounds
+    before = int(np.ceil((kernel_size - 1) / 2))
+    rows = border_indices(image.shape[0], before, kernel_size - 1 - before, mode)
+    columns = border_indices(image.shape[1], before, kernel_size - 1 - before, mode)
+    return image[np.ix_(rows[top:bottom + kernel_size - 1], columns[left:right + kernel_size - 1])]
+
+
+def apply_filter_border(image: np.array, kernel: np.array, mode: str = 'reflect', method: str = 'auto',
+                        out: np.array = None) -> np.array:
+    """
+    This function performs the same convolution as apply_filter, but
+    with the image extended by the given border mode instead of zeros.
+    The interior is correlated on the image itself, the strips along the
+    border are gathered with their halo through border_indices. With the
+    'fft' method, only the interior uses the FFT, the strips are summed
+    directly.
+    """
+    if mode not in BORDER_MODES:
+        raise ValueError(f"Unknown border mode '{mode}'.")
+    if mode == 'zero':
+        return apply_filter(image, kernel, method, out)
+    method = resolve_method(image, kernel, method)
+    if out is None:
+        out = np.empty(image.shape, dtype=image.dtype)
+    assert out.shape == image.shape
+    correlate_rows = rows_correlator(kernel, 'direct' if method == 'fft' else method, image.dtype)
+    strips = border_strips(image.shape, kernel.shape[0])
+    # the interior lies between the top and bottom, the left and right strips
+    interior = out[strips[0][1]:strips[1][0], strips[2][3]:strips[3][2]]
+    if interior.size and method == 'fft':
+        interior[...] = filtering.correlate_fft(image, kernel)[strips[0][1]:strips[1][0], strips[2][3]:strips[3][2]]
+    elif interior.size:
+        filtering.correlate_bands(image, kernel.shape[0], interior, correlate_rows)
+    for bounds in strips:
+        if bounds[1] > bounds[0] and bounds[3] > bounds[2]:
+            out[bounds[0]:bounds[1], bounds[2]:bounds[3]] = correlate_rows(read_border_tile(image, bounds, kernel.shape[0], mode))
+    return out
@@ -0,0 +1,47 @@
+"""
+Module Description: This module measures on the current machine the kernel
+size from which the FFT backend of apply_filter beats the direct one.
+"""
+import time
+import numpy as np
+from convolution.filtering import filtering
+
+
+def time_method(image: np.array, kernel: np.array, method: str, repeats: int = 3) -> float:
+    """
+    This function returns the best wall time in seconds of
+    apply_filter with the given method out of several repeats.
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        filtering.apply_filter(image, kernel, method)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure_fft_crossover(image_size: int = 512, kernel_sizes=range(3, 33, 2), repeats: int = 3) -> int:
+    """
+    This function times the direct and the FFT backend on a random
+    grayscale image for growing kernel sizes and returns the first
+    kernel size for which the FFT backend is faster. If it never is,
+    a size just above the largest measured kernel is returned.
+    """
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (image_size, image_size), dtype=np.uint8)
+    for kernel_size in kernel_sizes:
+        kernel = rng.random((kernel_size, kernel_size)) / kernel_size ** 2
+        if time_method(image, kernel, 'fft', repeats) < time_method(image, kernel, 'direct', repeats):
+            return kernel_size
+    return max(kernel_sizes) + 1
+
+
+def calibrate_fft_crossover(image_size: int = 512, kernel_sizes=range(3, 33, 2), repeats: int = 3) -> int:
+    """
+    This function measures the FFT crossover and stores it in
+    filtering.FFT_CROSSOVER, so that apply_filter(method='auto')
+    uses the value measured on this machine from now on.
+    """
+    kernel_size = measure_fft_crossover(image_size, kernel_sizes, repeats)
+    filtering.FFT_CROSSOVER['kernel_size'] = kernel_size
+    return kernel_size
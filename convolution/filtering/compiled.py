@@ -0,0 +1,106 @@
+"""
+Module Description: This module contains filters compiled once per kernel,
+for hot loops which filter many (small) images with the same kernels.
+"""
+import threading
+import numpy as np
+from convolution.filtering import filtering
+from convolution.filtering.filtering import FFT_CROSSOVER, FilterWorkspace, batch_as_image, batch_item, \
+    kernel_spectrum, resolve_method, rows_correlator
+
+# Number of compiled filters compile_filter keeps, the oldest one is dropped first
+COMPILED_FILTER_LIMIT = 256
+COMPILED_FILTERS = {}
+COMPILED_FILTERS_LOCK = threading.Lock()
+# Number of image shapes a compiled filter keeps FFT spectra for, the least
+# recently used one is dropped first
+COMPILED_SPECTRA_LIMIT = 8
+
+
+class CompiledFilter:
+    """
+    Holds everything apply_filter derives from a kernel: the backend is
+    chosen once per image dtype (and FFT crossover) together with its
+    separable factors or fixed-point accumulator, the FFT spectra of the
+    flipped kernel are kept for the last COMPILED_SPECTRA_LIMIT image
+    shapes and the padded image and the scratch buffers per thread, in a
+    FilterWorkspace sized by the largest image seen. A call on a small
+    crop then costs little more than the sums themselves. The result
+    equals apply_filter(image, kernel, method).
+    """
+
+    def __init__(self, kernel: np.array, method: str = 'auto'):
+        # a private read-only copy, so the kernel cannot change under the cached plans
+        self.kernel = np.array(kernel)
+        self.kernel.flags.writeable = False
+        assert self.kernel.ndim == 2
+        assert self.kernel.shape[0] == self.kernel.shape[1]
+        self.method = method
+        self.spectra = {}
+        self._spectra_lock = threading.Lock()
+        self._local = threading.local()
+
+    def backend(self, image: np.array) -> tuple:
+        """
+        Returns the backend for the image and the function computing the
+        sums of a band (None for 'fft'), both derived on first use.
+        """
+        if not hasattr(self._local, 'plans'):
+            self._local.plans, self._local.workspace = {}, FilterWorkspace()
+        key = (image.dtype, FFT_CROSSOVER['kernel_size'])
+        if key not in self._local.plans:
+            method = resolve_method(image, self.kernel, self.method)
+            correlate_rows = None if method == 'fft' else rows_correlator(self.kernel, method, image.dtype,
+                                                                          self._local.workspace)
+            self._local.plans[key] = method, correlate_rows
+        return self._local.plans[key]
+
+    def spectrum(self, shape: tuple) -> np.array:
+        """
+        Returns the kernel spectrum for images of the shape, computed on first use.
+        """
+        with self._spectra_lock:
+            # reinserting keeps the dict ordered from the least to the most recently used
+            spectrum = self.spectra.pop(shape, None)
+            if spectrum is None:
+                if len(self.spectra) >= COMPILED_SPECTRA_LIMIT:
+                    del self.spectra[next(iter(self.spectra))]
+                spectrum = kernel_spectrum(self.kernel, shape)
+            self.spectra[shape] = spectrum
+        return spectrum
+
+    def apply(self, image: np.array, out: np.array = None) -> np.array:
+        """
+        Performs the convolution over an image or a 4-D batch of images,
+        into out if given.
+        """
+        assert image.ndim in [2, 3, 4]
+        method, correlate_rows = self.backend(batch_item(image))
+        if out is None:
+            out = np.empty(image.shape, dtype=image.dtype)
+        if image.ndim == 4 and image.shape[0] == 0:
+            return out
+        shape = image.shape[1:3] if image.ndim == 4 else image.shape[:2]
+        if method == 'fft':
+            batch_as_image(out)[...] = filtering.correlate_fft(batch_as_image(image), self.kernel, self.spectrum(shape))
+        elif image.ndim == 4:
+            filtering.correlate_stacked(image, self.kernel.shape[0], out, correlate_rows, self._local.workspace)
+        else:
+            filtering.correlate_padded(image, self.kernel.shape[0], out, correlate_rows, self._local.workspace)
+        return out
+
+
+def compile_filter(kernel: np.array, method: str = 'auto') -> CompiledFilter:
+    """
+    This function returns the CompiledFilter of the kernel, memoized by
+    the method and the kernel's dtype, shape and bytes, so kernels with
+    the same content share one, e.g. those of the helpers.filters dict.
+    """
+    kernel = np.asarray(kernel)
+    key = (method, kernel.dtype.str, kernel.shape, kernel.tobytes())
+    with COMPILED_FILTERS_LOCK:
+        if key not in COMPILED_FILTERS:
+            if len(COMPILED_FILTERS) >= COMPILED_FILTER_LIMIT:
+                del COMPILED_FILTERS[next(iter(COMPILED_FILTERS))]
+            COMPILED_FILTERS[key] = CompiledFilter(kernel, method)
+        return COMPILED_FILTERS[key]
@@ -5,12 +5,36 @@ import numpy as np
 # import cv2
 # from PIL import Image
 
+# Kernel size from which apply_filter(method='auto') switches to the FFT backend,
+# calibration.calibrate_fft_crossover() measures and stores it for the current machine
+FFT_CROSSOVER = {'kernel_size': 9}
+# The FFT result is rounded to this many decimals to cancel the rounding noise
+# of the transform, so that the truncation to uint8 matches the direct sum
+FFT_DECIMALS = 6
+# Largest fixed-point shift of a kernel and largest sum of absolute kernel taps
+# times image values for which 'auto' uses the FFT backend: the fractions of the
+# exact sums are then multiples of 2^-16, far coarser than the rounding, and the
+# transform noise stays far below it, so the result equals the direct sum
+FFT_MAX_SHIFT = 16
+FFT_MAX_MAGNITUDE = 1 << 24
+# Size of the float64 scratch buffers the direct and separable backends
+# accumulate into, the output is produced in bands of rows of this size
+BAND_BYTES = 1 << 20
+# Cost of a tap of the integer backend relative to a float64 tap
+# (int16/int32 sums measured on a 2048x2048 RGB image)
+INTEGER_TAP_COST = 0.25
 
-def pad_image(image: np.array, kernel_size: int) -> np.array:
+# Weights of the R, G and B channels in the grayscale conversion (ITU-R BT.601 luma)
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def pad_image(image: np.array, kernel_size: int, dtype: np.dtype = float, out: np.array = None) -> np.array:
     """
     This function performs zero padding using the number of
     padding layers supplied as argument and return the padded
-    image.
+    image. Trailing (channel) dimensions are kept as they are.
+    If out is given, the padded image is written into it and
+    only its border is zeroed.
     """
     padding_height = kernel_size - 1
     padding_width = kernel_size - 1
@@ -18,7 +42,16 @@ def pad_image(image: np.array, kernel_size: int) -> np.array:
     # pad_right = int(np.floor(padding_width / 2))
     pad_up = int(np.ceil(padding_height / 2))
     # pad_down = int(np.floor(padding_height / 2))
-    padded_img = np.zeros((image.shape[0]+padding_height, image.shape[1]+padding_width))
+    padded_shape = (image.shape[0]+padding_height, image.shape[1]+padding_width) + image.shape[2:]
+    if out is None:
+        padded_img = np.zeros(padded_shape, dtype=dtype)
+    else:
+        assert out.shape == padded_shape
+        padded_img = out
+        padded_img[:pad_up] = 0
+        padded_img[pad_up+image.shape[0]:] = 0
+        padded_img[:, :pad_left] = 0
+        padded_img[:, pad_left+image.shape[1]:] = 0
     padded_img[pad_up:pad_up+image.shape[0], pad_left:pad_left+image.shape[1]] = image
     # padded_img = np.pad(image, [(pad_up, pad_down), (pad_left, pad_right)], mode='constant')
     return padded_img
@@ -39,35 +72,535 @@ def calculate_sum(image: np.array, kernel: np.array):
     return sum_convolve
 
 
-def apply_filter(image: np.array, kernel: np.array) -> np.array:
+def sliding_windows(padded_image: np.array, kernel_size: int) -> np.array:
     """
-    This function performs convolution over an image.
+    This function returns a read-only strided view of all
+    kernel_size x kernel_size windows of a padded image, so
+    that windows[i, j] is the patch which calculate_sum would
+    receive for the output pixel (i, j). No data is copied.
+    """
+    return np.lib.stride_tricks.sliding_window_view(padded_image, (kernel_size, kernel_size), axis=(0, 1))
+
+
+def sum_windows(windows: np.array, kernel: np.array, dtype: np.dtype = float, workspace=None, name: str = 'sum') -> np.array:
+    """
+    This function performs the sum over all windows and the kernel at once,
+    the last kernel.ndim axes of windows are the window axes.
+    The kernel taps are accumulated one by one in the same row-major
+    order as in calculate_sum, so every pixel goes through exactly the
+    same sequence of floating point additions and the result is
+    bit-identical to the scalar implementation. The products and sums
+    are computed in dtype. With a FilterWorkspace, the sum and the
+    products go into its buffers cached under name.
+    """
+    shape = windows.shape[:windows.ndim - kernel.ndim]
+    if workspace is None:
+        accumulated = np.zeros(shape, dtype=dtype)
+        product = np.empty_like(accumulated)
+    else:
+        accumulated = workspace.buffer(name, shape, dtype)
+        accumulated.fill(0)
+        product = workspace.buffer('product', shape, dtype)
+    for index, weight in np.ndenumerate(kernel):
+        np.multiply(windows[(Ellipsis,) + index], weight, out=product, dtype=dtype)
+        accumulated += product
+    return accumulated
+
+
+def correlate_windows(windows: np.array, kernel: np.array, workspace=None) -> np.array:
+    """
+    This function performs the sum over all windows and the kernel
+    at once and clips the result to the range <0, 255>.
+    """
+    accumulated = sum_windows(windows, kernel, workspace=workspace)
+    return np.clip(accumulated, 0, 255, out=accumulated)
+
+
+def fixed_point_shift(kernel: np.array, max_shift: int = 24):
+    """
+    This function returns the smallest shift s for which kernel * 2^s
+    holds only integers, i.e. the kernel is exactly representable in
+    binary fixed point (the 1/16 and 1/256 Gaussians are), otherwise None.
+    """
+    for shift in range(max_shift + 1):
+        scaled = np.asarray(kernel) * 2.0 ** shift
+        if np.all(scaled == np.round(scaled)):
+            return shift
+    return None
+
+
+def separable_factors(kernel: np.array, tolerance: float = 0.0):
+    """
+    This function splits a rank-1 kernel into a column and a row 1-D
+    kernel whose outer product reproduces it up to the tolerance, or
+    returns None. The factors are first taken from the row and column of
+    the smallest and then the largest nonzero entry, the smallest one keeps
+    binomial kernels such as the Gaussians in binary fixed point, so their
+    reconstruction is exact. If neither fits, e.g. for a positive tolerance
+    and a nearly rank-1 kernel, the leading SVD pair is used.
+    """
+    kernel = np.asarray(kernel, dtype=float)
+    magnitudes = np.abs(kernel)
+    for pivot in [np.argmin(np.where(kernel != 0, magnitudes, np.inf)), np.argmax(magnitudes)]:
+        i, j = divmod(int(pivot), kernel.shape[1])
+        if kernel[i, j] != 0:
+            column, row = kernel[:, j], kernel[i, :] / kernel[i, j]
+            if np.abs(np.outer(column, row) - kernel).max() <= tolerance:
+                return column, row
+    left, singular_values, right = np.linalg.svd(kernel)
+    column = left[:, 0] * np.sqrt(singular_values[0])
+    row = right[0] * np.sqrt(singular_values[0])
+    if np.abs(np.outer(column, row) - kernel).max() > tolerance:
+        return None
+    return column, row
+
+
+def dtype_magnitude(dtype: np.dtype) -> int:
+    """
+    This function returns the largest absolute value of an integer dtype.
+    """
+    return max(abs(int(np.iinfo(dtype).min)), int(np.iinfo(dtype).max))
+
+
+def integer_accumulator(dtype: np.dtype, kernel: np.array):
+    """
+    This function returns the fixed-point shift s of the kernel and the
+    smallest integer dtype which holds every sum of kernel * 2^s over an
+    image of the given dtype, or None if the integer backend does not
+    apply. It applies to integer images and binary fixed-point kernels
+    whose float64 sums are exact as well, then both backends agree.
+    """
+    shift = fixed_point_shift(kernel)
+    if not np.issubdtype(dtype, np.integer) or shift is None:
+        return None
+    bound = dtype_magnitude(dtype) * int(np.abs(kernel * 2.0 ** shift).sum())
+    if bound >= 2 ** 53:
+        return None
+    accumulator = next(acc for acc in (np.int16, np.int32, np.int64) if bound <= np.iinfo(acc).max)
+    return shift, np.dtype(accumulator)
+
+
+def correlate_integer(windows: np.array, kernel: np.array, shift: int, dtype: np.dtype, workspace=None) -> np.array:
+    """
+    This function performs the sum over all windows and the kernel scaled
+    by 2^shift in the integer dtype. Clipping the integer sum to
+    <0, 255 * 2^shift> and shifting it back truncates exactly like the
+    float64 path, so the result is bit-identical to correlate_windows.
+    """
+    accumulated = sum_windows(windows, np.round(kernel * 2.0 ** shift).astype(dtype), dtype, workspace)
+    np.clip(accumulated, 0, min(255 << shift, np.iinfo(dtype).max), out=accumulated)
+    accumulated >>= shift
+    return accumulated
+
+
+def is_exactly_separable(dtype: np.dtype, kernel: np.array) -> bool:
+    """
+    This function checks whether the two 1-D passes give bit-identical
+    results to the 2-D sum for images of the given dtype. That holds for
+    integer images and exactly separable binary fixed-point factors,
+    as long as no intermediate sum needs more than the 53 bits of float64.
+    """
+    factors = separable_factors(kernel)
+    if not np.issubdtype(dtype, np.integer) or factors is None:
+        return False
+    shifts = [fixed_point_shift(factor) for factor in factors]
+    if None in shifts:
+        return False
+    bound = dtype_magnitude(dtype)
+    for factor, shift in zip(factors, shifts):
+        bound *= int(np.abs(factor * 2.0 ** shift).sum())
+    return bound < 2 ** 53
+
+
+def correlate_separable(padded_image: np.array, column: np.array, row: np.array, workspace=None) -> np.array:
+    """
+    This function performs the sum of a rank-1 kernel np.outer(column, row)
+    as a horizontal pass with row followed by a vertical pass with column,
+    which costs 2k instead of k^2 multiply-adds per pixel. The result is
+    clipped to the range <0, 255>.
+    """
+    horizontal = sum_windows(np.lib.stride_tricks.sliding_window_view(padded_image, row.size, axis=1), row,
+                             workspace=workspace, name='horizontal')
+    vertical = sum_windows(np.lib.stride_tricks.sliding_window_view(horizontal, column.size, axis=0), column,
+                           workspace=workspace)
+    return np.clip(vertical, 0, 255, out=vertical)
+
+
+def fast_fft_length(size: int) -> int:
+    """
+    This function returns the smallest 5-smooth number (2^a * 3^b * 5^c)
+    which is not smaller than size, numpy's FFT is fastest for such lengths.
+    """
+    length, remainder = max(size, 1) - 1, 0
+    while remainder != 1:
+        length += 1
+        remainder = length
+        for factor in (2, 3, 5):
+            while remainder % factor == 0:
+                remainder //= factor
+    return length
+
+
+def kernel_spectrum(kernel: np.array, image_shape: tuple) -> np.array:
+    """
+    This function returns the spectrum of the flipped kernel which
+    correlate_fft multiplies the spectrum of an image of the given shape by.
+    """
+    return np.fft.rfft2(kernel[::-1, ::-1], [fast_fft_length(n + kernel.shape[0] - 1) for n in image_shape[:2]])
+
+
+def correlate_fft(image: np.array, kernel: np.array, spectrum: np.array = None) -> np.array:
+    """
+    This function performs the same zero padded sum as correlate_windows,
+    but through numpy.fft.rfft2, so the cost per pixel no longer grows with
+    the kernel area. The result is clipped to the range <0, 255>.
+    The spectrum of the kernel may be passed in precomputed.
+    """
+    kernel_size = kernel.shape[0]
+    # the ceil-biased padding of pad_image shifts the window start by pad_up
+    start = kernel_size - 1 - int(np.ceil((kernel_size - 1) / 2))
+    shape = [fast_fft_length(n + kernel_size - 1) for n in image.shape[:2]]
+    if spectrum is None:
+        spectrum = kernel_spectrum(kernel, image.shape)
+    spectrum = np.fft.rfft2(image, shape, axes=(0, 1)) * spectrum.reshape(spectrum.shape + (1,) * (image.ndim - 2))
+    full = np.fft.irfft2(spectrum, shape, axes=(0, 1))
+    result = np.round(full[start:start + image.shape[0], start:start + image.shape[1]], FFT_DECIMALS)
+    return np.clip(result, 0, 255, out=result)
+
+
+def fft_is_exact(dtype: np.dtype, kernel: np.array) -> bool:
+    """
+    This function checks whether the FFT backend is bit-identical to the
+    direct one for an image of the given dtype: only for integer images
+    and integer or binary fixed-point kernels (as for the integer backend)
+    with a shift of at most FFT_MAX_SHIFT and sums bounded by
+    FFT_MAX_MAGNITUDE. Float images and other kernels, e.g. the 1/81 box,
+    get rounding differences from the transform.
+    """
+    accumulator = integer_accumulator(dtype, kernel)
+    return accumulator is not None and accumulator[0] <= FFT_MAX_SHIFT and \
+        dtype_magnitude(dtype) * float(np.abs(kernel).sum()) <= FFT_MAX_MAGNITUDE
+
+
+def choose_method(image: np.array, kernel: np.array) -> str:
+    """
+    This function picks the backend for apply_filter(method='auto'), the
+    cheapest one per pixel counted in float64 multiply-adds: k^2 for
+    'direct', k^2 * INTEGER_TAP_COST for 'integer', 2k for 'separable'
+    and FFT_CROSSOVER['kernel_size']^2 for 'fft'. 'integer', 'separable'
+    and 'fft' are candidates only where they are bit-identical to 'direct',
+    for 'fft' that is where fft_is_exact.
+    """
+    kernel_size = kernel.shape[0]
+    costs = {}
+    if fft_is_exact(image.dtype, kernel):
+        # 'fft' goes first, so that it wins the tie at the crossover
+        costs['fft'] = FFT_CROSSOVER['kernel_size'] ** 2
+    costs['direct'] = kernel_size ** 2
+    if integer_accumulator(image.dtype, kernel) is not None:
+        costs['integer'] = kernel_size ** 2 * INTEGER_TAP_COST
+    if is_exactly_separable(image.dtype, kernel):
+        costs['separable'] = 2 * kernel_size
+    return min(costs, key=costs.get)
+
+
+def band_rows(shape: tuple) -> int:
+    """
+    This function returns how many rows of an image of the given shape
+    fit into one float64 scratch buffer of BAND_BYTES.
+    """
+    return max(1, BAND_BYTES // (8 * int(np.prod(shape[1:]))))
+
+
+def correlate_bands(padded_image: np.array, kernel_size: int, out: np.array, correlate_rows) -> np.array:
+    """
+    This function fills out band by band. correlate_rows receives the
+    padded rows of a band (including the kernel_size - 1 halo rows) and
+    returns their clipped sums, so the float64 scratch buffers never
+    exceed BAND_BYTES, whatever the image size or channel count.
+    """
+    step = band_rows(out.shape)
+    for top in range(0, out.shape[0], step):
+        bottom = min(top + step, out.shape[0])
+        out[top:bottom] = correlate_rows(padded_image[top:bottom + kernel_size - 1])
+    return out
+
+
+def resolve_method(image: np.array, kernel: np.array, method: str) -> str:
+    """
+    This function checks the image and the kernel and returns the
+    backend to use, 'auto' is resolved by choose_method.
     """
     # A given image has to have either 2 (grayscale) or 3 (RGB) dimensions
     assert image.ndim in [2, 3]
     # A given filter has to be 2-dimensional and square
     assert kernel.ndim == 2
     assert kernel.shape[0] == kernel.shape[1]
+    if method == 'auto':
+        method = choose_method(image, kernel)
+    if method not in ['direct', 'separable', 'integer', 'fft']:
+        raise ValueError(f"Unknown convolution method '{method}'.")
+    return method
 
-    if image.ndim == 2:  # Grayscale image
-        image_height, image_width = image.shape
-        padded_image = pad_image(image.copy(), kernel.shape[0])
-        convolved = np.zeros((image_height, image_width), dtype=image.dtype)
-
-        for i in range(image_height):
-            for j in range(image_width):
-                # tmp = padded_image[i:i + kernel.shape[0], j:j + kernel.shape[0]]
-                # tmp_kernel = tmp * kernel.sum()
-                convolved[i, j] = calculate_sum(padded_image[i:i + kernel.shape[0], j:j + kernel.shape[0]], kernel)
-
-    elif image.ndim == 3:  # RGB image
-        channels = [apply_filter(image[:, :, c], kernel) for c in range(image.shape[2])]
-        array_after_convolve = np.dstack(channels)
-        return array_after_convolve
-        # print(array_after_convolve)
-    else:
-        raise ValueError("Input dimensions are not valid for convolution.")
-    return convolved
+
+def rows_correlator(kernel: np.array, method: str, dtype: np.dtype, workspace=None):
+    """
+    This function returns the function correlate_bands applies to the
+    padded rows (of the given dtype) of every band for the 'direct',
+    'separable' or 'integer' backend, its scratch buffers are taken
+    from the workspace if one is given.
+    """
+    if method == 'integer':
+        accumulator = integer_accumulator(dtype, kernel)
+        if accumulator is None:
+            raise ValueError("The integer backend needs an integer image and a binary fixed-point kernel.")
+        return lambda rows: correlate_integer(sliding_windows(rows, kernel.shape[0]), kernel, *accumulator, workspace)
+    if method == 'separable':
+        factors = separable_factors(kernel)
+        if factors is None:
+            raise ValueError("The kernel is not separable.")
+        return lambda rows: correlate_separable(rows, *factors, workspace)
+    return lambda rows: correlate_windows(sliding_windows(rows, kernel.shape[0]), kernel, workspace)
+
+
+def correlate(image: np.array, kernel: np.array, method: str, out: np.array, workspace=None) -> np.array:
+    """
+    This function runs the selected backend over all channels at once
+    and writes the clipped sums into the preallocated out.
+    """
+    if method == 'fft':
+        batch_as_image(out)[...] = correlate_fft(batch_as_image(image), kernel)
+        return out
+    correlate_rows = rows_correlator(kernel, method, image.dtype, workspace)
+    if image.ndim == 4:
+        return correlate_stacked(image, kernel.shape[0], out, correlate_rows, workspace)
+    return correlate_padded(image, kernel.shape[0], out, correlate_rows, workspace)
+
+
+def correlate_padded(image: np.array, kernel_size: int, out: np.array, correlate_rows, workspace=None) -> np.array:
+    """
+    This function pads the image (into the workspace if one is given) and
+    fills out band by band with correlate_rows.
+    """
+    # a single padded copy in the input dtype, the sums are done in float64 per band
+    padded_image = None
+    if workspace is not None:
+        padded_shape = tuple(n + kernel_size - 1 for n in image.shape[:2]) + image.shape[2:]
+        padded_image = workspace.buffer('padded', padded_shape, image.dtype)
+    padded_image = pad_image(image, kernel_size, image.dtype, padded_image)
+    return correlate_bands(padded_image, kernel_size, out, correlate_rows)
+
+
+class FilterWorkspace:
+    """
+    Caches the padded image and the per-band scratch buffers of apply_filter
+    by name and dtype. Repeated calls at the same image shape, e.g. the
+    frames of a video, then allocate no image-sized buffers, except for
+    the spectra of the FFT backend. Each buffer grows to the largest
+    shape asked for and smaller shapes get a view of it, so a workspace
+    holds one buffer per name and dtype however many image shapes it
+    sees. A workspace must not be shared by threads running at the same time.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def buffer(self, name: str, shape: tuple, dtype: np.dtype) -> np.array:
+        """
+        Returns a buffer of the shape, a view of the cached one, which is
+        (re)allocated when it is too small.
+        """
+        key = (name, np.dtype(dtype))
+        size = int(np.prod(shape))
+        if key not in self.buffers or self.buffers[key].size < size:
+            self.buffers[key] = np.empty(size, dtype=dtype)
+        return self.buffers[key][:size].reshape(shape)
+
+    def apply_filter(self, image: np.array, kernel: np.array, method: str = 'auto', out: np.array = None) -> np.array:
+        """
+        Performs apply_filter using the buffers of this workspace.
+        """
+        return apply_filter(image, kernel, method, out, self)
+
+
+def apply_filter(image: np.array, kernel: np.array, method: str = 'auto', out: np.array = None,
+                 workspace: FilterWorkspace = None) -> np.array:
+    """
+    This function performs convolution over an image.
+    The method selects the backend: 'direct' sums the kernel taps over
+    a window view, 'separable' runs two 1-D passes for rank-1 kernels,
+    'integer' sums binary fixed-point kernels in int16/int32 for integer
+    images, 'fft' multiplies spectra and 'auto' picks one by choose_method.
+    RGB images are padded once and all channels are convolved together.
+    A 4-D batch of same-sized images (N, H, W, C) is convolved in one
+    call as well, grayscale batches have the shape (N, H, W, 1).
+    The result is written into out if given (of the image shape, any
+    dtype), the padded image and the sums into the buffers of workspace.
+    """
+    method = resolve_method(batch_item(image), kernel, method)
+    if out is None:
+        out = np.empty(image.shape, dtype=image.dtype)
+    assert out.shape == image.shape
+    if image.ndim == 4 and image.shape[0] == 0:
+        return out
+    return correlate(image, kernel, method, out, workspace)
+
+
+def batch_item(images: np.array) -> np.array:
+    """
+    This function returns for a 4-D batch (N, H, W, C) a zero-strided
+    stand-in of the shape and dtype of one of its images, which the
+    backend is resolved on, also for an empty batch. Other arrays are
+    returned as they are.
+    """
+    return np.broadcast_to(np.zeros((), dtype=images.dtype), images.shape[1:]) if images.ndim == 4 else images
+
+
+def batch_as_image(images: np.array) -> np.array:
+    """
+    This function returns a 4-D batch (N, H, W, C) as a view of the shape
+    (H, W, N, C), which pad_image and correlate_fft treat as one image with
+    N * C channels. Other arrays are returned as they are.
+    """
+    return np.moveaxis(images, 0, 2) if images.ndim == 4 else images
+
+
+def correlate_stacked(images: np.array, kernel_size: int, out: np.array, correlate_rows, workspace=None) -> np.array:
+    """
+    This function fills out for a 4-D batch of images (N, H, W, C). The
+    padded images are stacked on top of each other into one tall padded
+    image, which correlate_rows sums in bands of whole images. The
+    kernel_size - 1 rows of sums between two images mix both and are
+    dropped, the memory stays contiguous and no image is transposed.
+    """
+    count, height = images.shape[:2]
+    pitch = height + kernel_size - 1
+    stacked_shape = (count * pitch + kernel_size - 1, images.shape[2] + kernel_size - 1) + images.shape[3:]
+    stacked = np.empty(stacked_shape, dtype=images.dtype) if workspace is None else \
+        workspace.buffer('stacked', stacked_shape, images.dtype)
+    stacked[count * pitch:] = 0
+    padded_images = stacked[:count * pitch].reshape((count, pitch) + stacked_shape[1:])
+    pad_image(batch_as_image(images), kernel_size, images.dtype, batch_as_image(padded_images))
+    step = max(1, BAND_BYTES // (8 * pitch * int(np.prod(out.shape[2:]))))
+    for first in range(0, count, step):
+        last = min(first + step, count)
+        sums = correlate_rows(stacked[first * pitch:last * pitch + kernel_size - 1])
+        out[first:last] = sums.reshape((last - first, pitch) + sums.shape[1:])[:, :height]
+    return out
+
+
+def shared_band_correlators(image: np.array, kernels: list, method: str, size: int, stacked: np.array) -> list:
+    """
+    This function resolves the backend of every kernel for apply_filters.
+    The 'fft' kernels are transformed on the whole image straight into
+    stacked, for the others it returns their index, where their halo
+    starts inside the halo of the largest kernel size and their
+    rows_correlator.
+    """
+    banded = []
+    for index, kernel in enumerate(kernels):
+        kernel_method = resolve_method(image, kernel, method)
+        if kernel_method == 'fft':
+            stacked[index] = correlate_fft(image, kernel)
+        else:
+            offset = int(np.ceil((size - 1) / 2)) - int(np.ceil((kernel.shape[0] - 1) / 2))
+            banded.append((index, offset, rows_correlator(kernel, kernel_method, image.dtype)))
+    return banded
+
+
+def correlate_shared_bands(padded_image: np.array, kernels: list, banded: list, stacked: np.array) -> np.array:
+    """
+    This function fills stacked band by band, every kernel of banded sums
+    its part of the same rows of the image padded for the largest kernel.
+    """
+    height, width = stacked.shape[1:3]
+    step = band_rows(stacked.shape[1:])
+    for top in range(0, height, step):
+        bottom = min(top + step, height)
+        for index, offset, correlate_rows in banded:
+            halo = kernels[index].shape[0] - 1
+            stacked[index, top:bottom] = correlate_rows(padded_image[top + offset:bottom + offset + halo,
+                                                                     offset:offset + width + halo])
+    return stacked
+
+
+def apply_filters(image: np.array, kernels, method: str = 'auto'):
+    """
+    This function applies several kernels to one image in a single pass.
+    The image is padded once for the largest kernel and every kernel runs
+    its own backend (picked by choose_method for 'auto') on the shared
+    bands of the padded image, smaller kernels read the centered part of
+    the larger halo. Kernels for the 'fft' backend are transformed on the
+    whole image. The result of each kernel equals apply_filter(image,
+    kernel, method). A dict of kernels gives a dict of filtered images,
+    any other sequence an array stacked along a new first axis.
+    """
+    kernel_list = list(kernels.values()) if isinstance(kernels, dict) else list(kernels)
+    size = max(kernel.shape[0] for kernel in kernel_list)
+    stacked = np.empty((len(kernel_list),) + image.shape, dtype=image.dtype)
+    banded = shared_band_correlators(image, kernel_list, method, size, stacked)
+    correlate_shared_bands(pad_image(image, size, image.dtype), kernel_list, banded, stacked)
+    if isinstance(kernels, dict):
+        return dict(zip(kernels, stacked))
+    return stacked
+
+
+def apply_separable_filter(image: np.array, column: np.array, row: np.array) -> np.array:
+    """
+    This function performs convolution with the kernel np.outer(column, row)
+    given directly by its two 1-D factors of the same length, e.g. the
+    Gaussian from orb_detector.utils.get_gaussian_kernel used for both.
+    """
+    assert image.ndim in [2, 3]
+    assert column.ndim == row.ndim == 1
+    assert column.size == row.size
+    return correlate_bands(pad_image(image, row.size, image.dtype), row.size, np.empty(image.shape, dtype=image.dtype),
+                           lambda rows: correlate_separable(rows, column, row))
+
+
+def luma_rows(rgb: np.array, out: np.array) -> np.array:
+    """
+    This function writes the luma of RGB rows into out, computed exactly
+    as np.average(rgb.astype(float), weights=LUMA_WEIGHTS, axis=2) and
+    cast to the dtype of out: the weighted channels are summed in the
+    same order and divided by the same weight sum, so the result is
+    bit-identical (checked on all 2^24 RGB colors).
+    """
+    luma = np.multiply(rgb[..., 0], LUMA_WEIGHTS[0], dtype=float)
+    product = np.empty_like(luma)
+    for channel in [1, 2]:
+        np.multiply(rgb[..., channel], LUMA_WEIGHTS[channel], out=product, dtype=float)
+        luma += product
+    luma /= np.sum(LUMA_WEIGHTS)
+    out[...] = luma
+    return out
+
+
+def apply_filter_gray(rgb: np.array, kernel: np.array, method: str = 'auto', out: np.array = None) -> np.array:
+    """
+    This function performs convolution over the grayscale version of an
+    RGB image, with the same result as converting it by np.average with
+    LUMA_WEIGHTS to uint8 and calling apply_filter. The luma is written
+    band by band straight into the padded buffer, so neither the float
+    RGB copy nor the grayscale image are ever made.
+    """
+    assert rgb.ndim == 3 and rgb.shape[2] == 3
+    gray_shape = rgb.shape[:2]
+    method = resolve_method(np.broadcast_to(np.zeros((), dtype=np.uint8), gray_shape), kernel, method)
+    if out is None:
+        out = np.empty(gray_shape, dtype=np.uint8)
+    assert out.shape == gray_shape
+    kernel_size = kernel.shape[0]
+    before = int(np.ceil((kernel_size - 1) / 2))
+    padded_image = np.zeros((gray_shape[0] + kernel_size - 1, gray_shape[1] + kernel_size - 1), dtype=np.uint8)
+    gray = padded_image[before:before + gray_shape[0], before:before + gray_shape[1]]
+    step = band_rows(rgb.shape)
+    for top in range(0, gray_shape[0], step):
+        luma_rows(rgb[top:top + step], gray[top:top + step])
+    if method == 'fft':
+        out[...] = correlate_fft(gray, kernel)
+        return out
+    return correlate_bands(padded_image, kernel_size, out, rows_correlator(kernel, method, np.uint8))
 
 
 if __name__ == '__main__':
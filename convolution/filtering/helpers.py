@@ -1,5 +1,7 @@
+import io
+import struct
 import numpy as np
-from PIL import Image
+from PIL import Image, TiffImagePlugin
 from IPython.display import display
 
 identity_kernel = np.array([
@@ -75,3 +77,151 @@ def display_image(array, mode='RGB'):
 
 def save_image(array, file_path, mode='RGB'):
     image_from_array(array, mode=mode).save(file_path)
+
+
+# Channels of the PIL modes map_image and create_image handle, all uint8
+MAPPED_MODES = {'L': 1, 'RGB': 3, 'RGBA': 4}
+# struct formats of the TIFF field types SHORT, LONG and LONG8
+TIFF_FORMATS = {3: 'H', 4: 'I', 16: 'Q'}
+# Largest offset a classic TIFF can hold, larger images are written as BigTIFF
+TIFF_OFFSET_LIMIT = (1 << 32) - 1
+
+
+def tiff_pixel_layout(file_name):
+    """
+    Returns the (offset, shape) of the pixels of an uncompressed uint8 TIFF
+    whose strips are stored top-down one after the other, otherwise None.
+    Only the header is read, so gigapixel images are not refused as
+    decompression bombs the way Image.open refuses them.
+    """
+    try:
+        image = TiffImagePlugin.TiffImageFile(file_name)
+    except SyntaxError:  # not a TIFF file
+        return None
+    with image:
+        if image.mode not in MAPPED_MODES:
+            return None
+        width, height = image.size
+        shape = (height, width) if image.mode == 'L' else (height, width, MAPPED_MODES[image.mode])
+        row_bytes = width * MAPPED_MODES[image.mode]
+        offset = image.tile[0][2]
+        # tiles are unpacked by position, older Pillow has plain tuples without field names
+        for codec_name, (left, top, right, _), tile_offset, args in image.tile:
+            if codec_name != 'raw' or args != (image.mode, 0, 1) or (left, right) != (0, width) or \
+                    tile_offset != offset + top * row_bytes:
+                return None
+        return offset, shape
+
+
+def map_image(file_name, shape=None, dtype=np.uint8, offset=0) -> np.memmap:
+    """
+    Returns the image as a read-only np.memmap, nothing is decoded or
+    read until the pixels are accessed: .npy files, uncompressed TIFF files
+    with contiguous strips and raw files given by shape, dtype and offset.
+    """
+    if shape is not None:
+        return np.memmap(file_name, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+    if str(file_name).endswith('.npy'):
+        return np.load(file_name, mmap_mode='r')
+    layout = tiff_pixel_layout(file_name)
+    if layout is None:
+        raise ValueError(f'{file_name} can not be memory-mapped, it is compressed or not a TIFF or NPY file.')
+    return np.memmap(file_name, dtype=np.uint8, mode='r', offset=layout[0], shape=layout[1])
+
+
+def read_region(file_name, bounds) -> np.array:
+    """
+    Returns a copy of the (top, bottom, left, right) region of an image.
+    Memory-mappable files are read only for the rows of the region,
+    other formats are decoded by PIL and cropped.
+    """
+    top, bottom, left, right = bounds
+    try:
+        return np.array(map_image(file_name)[top:bottom, left:right])
+    except ValueError:
+        with Image.open(file_name) as image:
+            return np.asarray(image.crop((left, top, right, bottom)), dtype=np.uint8)
+
+
+def tiff_directory(header: bytes, entries: list, big: bool) -> bytes:
+    """
+    Returns the header followed by the directory of the (tag, type, values)
+    entries and the values which do not fit into their entry. The strip
+    offset, the sixth entry, points past them to where the pixels follow.
+    """
+    count_format, field_size = ('Q', 8) if big else ('I', 4)
+    extra_offset = len(header) + len(entries) * (4 + 2 * field_size) + field_size
+    fields, extra = [], b''
+    for tag, field_type, values in entries:
+        data = struct.pack(f'<{len(values)}{TIFF_FORMATS[field_type]}', *values)
+        if len(data) > field_size:  # values which do not fit into the entry follow the directory
+            data, extra = struct.pack(f'<{count_format}', extra_offset + len(extra)), extra + data
+        fields.append(struct.pack(f'<HH{count_format}', tag, field_type, len(values)) + data.ljust(field_size, b'\x00'))
+    fields[5] = fields[5][:4 + field_size] + struct.pack(f'<{count_format}', extra_offset + len(extra))
+    return header + b''.join(fields) + struct.pack(f'<{count_format}', 0) + extra
+
+
+def tiff_header(shape) -> bytes:
+    """
+    Returns the header of an uncompressed single-strip uint8 TIFF, the
+    pixels follow right after it. Images whose pixels end beyond
+    TIFF_OFFSET_LIMIT get a BigTIFF header, whose offsets have 64 bits.
+    """
+    height, width = shape[:2]
+    channels = shape[2] if len(shape) > 2 else 1
+    assert channels in MAPPED_MODES.values()
+    pixel_bytes = height * width * channels
+    big = pixel_bytes + 512 > TIFF_OFFSET_LIMIT
+    # BigTIFF has 64-bit counts and offsets, 20-byte entries and LONG8 (16) strip offsets and sizes
+    strip_type = 16 if big else 4
+    entries = [(256, 4, [width]), (257, 4, [height]), (258, 3, [8] * channels), (259, 3, [1]),
+               (262, 3, [1 if channels == 1 else 2]), (273, strip_type, [0]), (277, 3, [channels]),
+               (278, 4, [height]), (279, strip_type, [pixel_bytes]), (284, 3, [1])]
+    if channels == 4:
+        entries.append((338, 3, [2]))  # the fourth channel is unassociated alpha
+    header = b'II+\x00' + struct.pack('<HHQ', 8, 0, 16) if big else b'II*\x00' + struct.pack('<I', 8)
+    return tiff_directory(header + struct.pack('<Q' if big else '<H', len(entries)), entries, big)
+
+
+def image_header(file_path, shape, dtype=np.uint8) -> bytes:
+    """
+    Returns the header create_image and write_rows put before the
+    pixels: NPY for .npy, TIFF for .tif/.tiff and none for raw files.
+    """
+    path = str(file_path)
+    if path.endswith('.npy'):
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': tuple(shape)}
+        buffer = io.BytesIO()
+        np.lib.format.write_array_header_1_0(buffer, header)
+        return buffer.getvalue()
+    if path.endswith(('.tif', '.tiff')):
+        assert np.dtype(dtype) == np.uint8
+        return tiff_header(shape)
+    return b''
+
+
+def create_image(file_path, shape, dtype=np.uint8) -> np.memmap:
+    """
+    Creates an image file of the given shape and returns its pixels as a
+    writable np.memmap, e.g. as the out of apply_filter_tiled. Flush it
+    when done, the rows are written back by the operating system.
+    """
+    header = image_header(file_path, shape, dtype)
+    with open(file_path, 'wb') as file:
+        file.write(header)
+        file.truncate(len(header) + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return np.memmap(file_path, dtype=dtype, mode='r+', offset=len(header), shape=tuple(shape))
+
+
+def write_rows(file_path, shape, bands, dtype=np.uint8):
+    """
+    Writes an image file of the given shape from an iterable of bands of
+    rows, top to bottom, keeping only one band in memory at a time.
+    """
+    written = 0
+    with open(file_path, 'wb') as file:
+        file.write(image_header(file_path, shape, dtype))
+        for band in bands:
+            file.write(np.ascontiguousarray(band, dtype=dtype).tobytes())
+            written += len(band)
+    assert written == shape[0], f'{written} rows were written instead of {shape[0]}.'
@@ -0,0 +1,52 @@
+"""
+Module Description: This module contains functions for multi-core image
+filtering, the image is split into horizontal bands convolved in a thread pool.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from convolution.filtering import filtering
+from convolution.filtering.filtering import resolve_method, rows_correlator
+from convolution.filtering.tiling import filter_tile
+
+
+def band_bounds(height: int, bands: int) -> list:
+    """
+    This function splits height rows into at most the given number
+    of nearly equal bands and returns their (top, bottom) bounds.
+    """
+    edges = np.linspace(0, height, max(1, min(bands, height)) + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def apply_filter_parallel(image: np.array, kernel: np.array, method: str = 'auto', out: np.array = None,
+                          workers: int = None) -> np.array:
+    """
+    This function performs the same convolution as apply_filter, with
+    one horizontal band of rows per worker thread (os.cpu_count() by
+    default). The padded image is shared by all bands, every band reads
+    its rows plus a (k-1)-row halo and writes straight into its rows of
+    out. NumPy releases the GIL inside the band sums, so threads scale.
+    """
+    method = resolve_method(image, kernel, method)
+    if out is None:
+        out = np.empty(image.shape, dtype=image.dtype)
+    assert out.shape == image.shape
+    workers = workers or os.cpu_count() or 1
+    kernel_size = kernel.shape[0]
+
+    if method == 'fft':
+        def filter_band(bounds):
+            out[bounds[0]:bounds[1]] = filter_tile(image, kernel, method, (bounds[0], bounds[1], 0, image.shape[1]))
+    else:
+        padded_image = filtering.pad_image(image, kernel_size, image.dtype)
+        correlate_rows = rows_correlator(kernel, method, image.dtype)
+
+        def filter_band(bounds):
+            filtering.correlate_bands(padded_image[bounds[0]:bounds[1] + kernel_size - 1], kernel_size,
+                                      out[bounds[0]:bounds[1]], correlate_rows)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # consume the results so that exceptions from the bands are raised here
+        list(executor.map(filter_band, band_bounds(image.shape[0], workers)))
+    return out
@@ -0,0 +1,165 @@
+"""
+Module Description: This module contains a lazy chain of filters which fuses
+adjacent kernels where the clipping allows it and otherwise runs the chain
+tile by tile, so that the intermediate images stay small.
+"""
+import numpy as np
+from convolution.filtering.filtering import apply_filter, resolve_method, rows_correlator, separable_factors
+from convolution.filtering.tiling import halo_padding, iter_tiles, read_tile, tile_shape
+
+# Amount of memory the intermediates of one tile may use, about the size of a
+# last level cache, smaller tiles lose more to the per-tile numpy call overhead
+PIPELINE_TILE_BUDGET = 8 << 20
+
+
+def compose_kernels(first: np.array, second: np.array) -> np.array:
+    """
+    This function returns the kernel which applies first and then second
+    in one apply_filter call (ignoring the clipping in between). Two even
+    kernels get one extra zero row and column at the bottom and right, so
+    that the ceil-biased padding of the result still lines up.
+    """
+    size = first.shape[0] + second.shape[0] - 1
+    offset = halo_padding(first.shape[0])[0] + halo_padding(second.shape[0])[0]
+    size += int(halo_padding(size)[0] < offset)
+    combined = np.zeros((size, size))
+    for (i, j), weight in np.ndenumerate(second):
+        combined[i:i + first.shape[0], j:j + first.shape[0]] += weight * first
+    return combined
+
+
+def preserves_range(kernel: np.array) -> bool:
+    """
+    This function checks whether the kernel maps images with values in
+    <0, 255> into <0, 255>, then the clipping after it never changes anything.
+    """
+    return bool(np.all(kernel >= 0) and kernel.sum() <= 1)
+
+
+def kernel_cost(kernel: np.array) -> int:
+    """
+    This function returns the multiply-adds per pixel of a kernel,
+    2k for separable kernels and k^2 otherwise.
+    """
+    return 2 * kernel.shape[0] if separable_factors(kernel) is not None else kernel.shape[0] ** 2
+
+
+def border_strips(image_shape, margin: int) -> list:
+    """
+    This function returns the bounds of the four strips of the given
+    width along the image border.
+    """
+    height, width = image_shape[:2]
+    return [(0, min(margin, height), 0, width), (max(height - margin, 0), height, 0, width),
+            (0, height, 0, min(margin, width)), (0, height, max(width - margin, 0), width)]
+
+
+def stage_runner(kernel: np.array, method: str, dtype: np.dtype):
+    """
+    This function returns the function which filters a tile read with
+    its halo by read_tile into the tile itself, the halo tile already is
+    the zero padding, so the direct, separable and integer backends run
+    on it without padding it again.
+    """
+    size = kernel.shape[0]
+    if method == 'fft':
+        before = halo_padding(size)[0]
+        return lambda tile: apply_filter(tile, kernel, method)[before:before + tile.shape[0] - size + 1,
+                                                               before:before + tile.shape[1] - size + 1]
+    correlate_rows = rows_correlator(kernel, method, dtype)
+    return lambda tile: correlate_rows(tile).astype(dtype, copy=False)
+
+
+def filter_chain_tile(image: np.array, runners: list, bounds: tuple) -> np.array:
+    """
+    This function returns the tile given by bounds after all stages,
+    given as (kernel size, stage_runner) pairs. Every stage is computed
+    only on the part of the image the later stages read, grown by their
+    halos and cut at the image border, outside of it the intermediate is
+    zero just as if it was padded by pad_image.
+    """
+    regions = [bounds]
+    for size, _ in reversed(runners[1:]):
+        before, after = halo_padding(size)
+        region = regions[0]
+        regions.insert(0, (max(region[0] - before, 0), min(region[1] + after, image.shape[0]),
+                           max(region[2] - before, 0), min(region[3] + after, image.shape[1])))
+    data, origin = image, (0, 0)
+    for (size, run), region in zip(runners, regions):
+        relative = (region[0] - origin[0], region[1] - origin[0], region[2] - origin[1], region[3] - origin[1])
+        data, origin = run(read_tile(data, relative, size)), (region[0], region[2])
+    return data
+
+
+class FilterPipeline:
+    """
+    Records a chain of kernels, e.g. FilterPipeline().then(blur).then(edges),
+    and applies it on apply(). The result is that of calling apply_filter
+    with every kernel in turn.
+    With method='auto', float images with values in <0, 255> get adjacent
+    kernels pre-convolved into one where the first of them preserves the
+    value range (so the skipped clipping would not have changed anything)
+    and the combined kernel is not more expensive. Those stages are equal
+    to the chain up to floating point rounding, all other stages are exact.
+    Chains of several stages run tile by tile within memory_budget.
+    """
+
+    def __init__(self, kernels=None, method: str = 'auto', memory_budget: int = PIPELINE_TILE_BUDGET):
+        self.kernels = list(kernels or [])
+        self.method = method
+        self.memory_budget = memory_budget
+
+    def then(self, kernel: np.array) -> 'FilterPipeline':
+        """
+        Records one more kernel and returns the pipeline for chaining.
+        """
+        self.kernels.append(kernel)
+        return self
+
+    def stages(self, image: np.array, fuse: bool = True) -> list:
+        """
+        Returns the (kernel, method) stages the chain runs for the image.
+        """
+        fuse = fuse and self.method == 'auto' and np.issubdtype(image.dtype, np.floating) and \
+            image.size > 0 and image.min() >= 0 and image.max() <= 255
+        groups = []
+        for kernel in self.kernels:
+            if fuse and groups and preserves_range(groups[-1][0]):
+                fused = compose_kernels(groups[-1][0], kernel)
+                if kernel_cost(fused) <= kernel_cost(groups[-1][0]) + kernel_cost(kernel):
+                    groups[-1] = (fused, True)
+                    continue
+            groups.append((kernel, False))
+        # a fused float stage is inexact anyway, so it may use the separable passes
+        return [(kernel, 'separable' if fused and separable_factors(kernel) is not None
+                 else resolve_method(image, kernel, self.method)) for kernel, fused in groups]
+
+    def apply(self, image: np.array) -> np.array:
+        """
+        Applies all recorded kernels to the image. The fused kernels see
+        the image itself where the chain saw zero padded intermediates, so
+        a border frame as wide as all halos together is redone unfused.
+        """
+        assert self.kernels, 'The pipeline has no kernels.'
+        stages = self.stages(image)
+        margin = sum(kernel.shape[0] - 1 for kernel in self.kernels)
+        if len(stages) == 1:
+            out = apply_filter(image, *stages[0])
+        else:
+            out = np.empty(image.shape, dtype=image.dtype)
+            bytes_per_pixel = 8 * int(np.prod(image.shape[2:])) * (len(stages) + 2)
+            tile = tile_shape(image.shape, margin + 1, self.memory_budget, bytes_per_pixel)
+            self.run_tiles(image, stages, iter_tiles(image.shape, tile), out)
+        # a chain of 1x1 kernels has no halo, so there is no border frame to redo
+        if len(stages) < len(self.kernels) and margin > 0:
+            self.run_tiles(image, self.stages(image, fuse=False), border_strips(image.shape, margin), out)
+        return out
+
+    @staticmethod
+    def run_tiles(image: np.array, stages: list, tiles, out: np.array):
+        """
+        Runs the stages tile by tile and writes the tiles into out.
+        """
+        runners = [(kernel.shape[0], stage_runner(kernel, method, image.dtype)) for kernel, method in stages]
+        for bounds in tiles:
+            out[bounds[0]:bounds[1], bounds[2]:bounds[3]] = filter_chain_tile(image, runners, bounds)
@@ -0,0 +1,148 @@
+"""
+Module Description: This module contains opt-in profiling of the filtering
+module: per-stage wall time, allocated bytes, calls and channels, reported
+as a dict or as Prometheus text.
+"""
+import contextlib
+import functools
+import threading
+import time
+import numpy as np
+from convolution.filtering import filtering
+
+# Stage under which each instrumented function of the filtering module is
+# recorded, 'filter' is one convolution (or one band of apply_filter_parallel)
+# and includes the others, a stage called within the same stage is not recorded
+# again, so e.g. correlate calling correlate_padded counts as one 'filter'
+STAGES = {
+    'correlate': 'filter',
+    'correlate_padded': 'filter',
+    'correlate_stacked': 'filter',
+    'correlate_bands': 'filter',
+    'pad_image': 'pad',
+    'sliding_windows': 'windows',
+    'sum_windows': 'sums',
+    'correlate_fft': 'fft',
+    'luma_rows': 'luma',
+}
+# Stages whose first argument is the image, the others get windows of it
+IMAGE_STAGES = ['filter', 'pad', 'fft', 'luma']
+# The profiles of all profile_filtering blocks running at the moment, the
+# functions of the filtering module are wrapped while there is at least one
+ACTIVE_PROFILES = []
+ORIGINAL_FUNCTIONS = {}
+PROFILES_LOCK = threading.Lock()
+RUNNING_STAGES = threading.local()
+
+
+class FilterProfile:
+    """
+    Collects the calls, wall time in seconds, bytes of the newly allocated
+    arrays returned and image channels processed per stage, so e.g. the
+    calls per channel are calls / channels. Bytes count the arrays a stage
+    returns which own their memory (a view or a workspace buffer counts
+    nothing), not the temporaries inside.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, result, channels: int):
+        """
+        Adds one call of the stage.
+        """
+        allocated = result.nbytes if isinstance(result, np.ndarray) and result.base is None else 0
+        with self._lock:
+            values = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'channels': 0})
+            values['calls'] += 1
+            values['seconds'] += seconds
+            values['bytes'] += allocated
+            values['channels'] += channels
+
+    def report(self) -> dict:
+        """
+        Returns a copy of the collected values per stage.
+        """
+        with self._lock:
+            return {stage: dict(values) for stage, values in self.stages.items()}
+
+    def prometheus(self, prefix: str = 'convolution_filtering') -> str:
+        """
+        Returns the collected values in the Prometheus text exposition format.
+        """
+        report = self.report()
+        lines = []
+        for name in ['calls', 'seconds', 'bytes', 'channels']:
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines += [f'{prefix}_{name}_total{{stage="{stage}"}} {values[name]}' for stage, values in report.items()]
+        return '\n'.join(lines) + '\n'
+
+
+def image_channels(image: np.array) -> int:
+    """
+    This function returns the number of channels of an image, counting
+    every channel of every image of a 4-D batch (N, H, W, C).
+    """
+    if image.ndim == 4:
+        return image.shape[0] * image.shape[3]
+    return int(np.prod(image.shape[2:]))
+
+
+def instrument(stage: str, function):
+    """
+    This function returns function wrapped so that every call is recorded
+    in all active profiles, with the channels of the image for the
+    IMAGE_STAGES. Calls made while the same stage already runs in the
+    thread are part of that call and are not recorded.
+    """
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        running = RUNNING_STAGES.__dict__.setdefault('stages', set())
+        if stage in running:
+            return function(*args, **kwargs)
+        running.add(stage)
+        try:
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+        finally:
+            running.discard(stage)
+        channels = image_channels(args[0]) if stage in IMAGE_STAGES else 0
+        for profile in tuple(ACTIVE_PROFILES):
+            profile.record(stage, seconds, result, channels)
+        return result
+    return timed
+
+
+@contextlib.contextmanager
+def profile_filtering(profile: FilterProfile = None):
+    """
+    This context manager records every stage of the filtering module run
+    inside it, in all threads, and yields the FilterProfile:
+
+        with profile_filtering() as profile:
+            apply_filter(image, kernel)
+        print(profile.prometheus())
+
+    The functions of the filtering module are swapped for timed wrappers
+    when the first block is entered and restored when the last one is
+    left, so blocks may overlap, e.g. in several threads, and outside of
+    them profiling costs nothing.
+    """
+    profile = profile or FilterProfile()
+    with PROFILES_LOCK:
+        if not ACTIVE_PROFILES:
+            ORIGINAL_FUNCTIONS.update({name: getattr(filtering, name) for name in STAGES})
+            for name, function in ORIGINAL_FUNCTIONS.items():
+                setattr(filtering, name, instrument(STAGES[name], function))
+        ACTIVE_PROFILES.append(profile)
+    try:
+        yield profile
+    finally:
+        with PROFILES_LOCK:
+            ACTIVE_PROFILES.remove(profile)
+            if not ACTIVE_PROFILES:
+                for name, function in ORIGINAL_FUNCTIONS.items():
+                    setattr(filtering, name, function)
+                ORIGINAL_FUNCTIONS.clear()
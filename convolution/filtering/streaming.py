@@ -0,0 +1,91 @@
+"""
+Module Description: This module contains a streaming pipeline for filtering
+long sequences of image files, decoding, filtering and encoding overlap.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from convolution.filtering.filtering import apply_filter
+from convolution.filtering.helpers import read_image, save_image
+
+STAGES = ('decode', 'filter', 'encode')
+
+
+class StreamingFilter:
+    """
+    Filters a sequence of image files with one kernel. Files are decoded
+    ahead by a background thread, filtered by a pool of worker threads
+    and encoded and saved in order by the calling thread. At most
+    queue_size frames are in flight, so a slow stage holds back the
+    stages before it instead of letting decoded frames pile up in memory.
+    Override read() and save() for other sources, e.g. video dumps.
+    """
+
+    def __init__(self, kernel: np.array, method: str = 'auto', workers: int = None, queue_size: int = 4):
+        self.kernel = kernel
+        self.method = method
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = max(1, queue_size)
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def read(self, source) -> np.array:
+        """
+        Decodes one frame.
+        """
+        return read_image(source)
+
+    def save(self, array: np.array, target):
+        """
+        Encodes and saves one filtered frame.
+        """
+        mode = 'L' if array.ndim == 2 else {3: 'RGB', 4: 'RGBA'}[array.shape[2]]
+        save_image(array, target, mode=mode)
+
+    def run(self, sources, targets) -> dict:
+        """
+        Filters every source into the target at the same position
+        and returns the per-stage throughput as reported by report().
+        """
+        self.stages = {stage: {'frames': 0, 'seconds': 0.0} for stage in STAGES + ('total',)}
+        start = time.perf_counter()
+        in_flight = deque()
+        with ThreadPoolExecutor(1) as decoder, ThreadPoolExecutor(self.workers) as filters:
+            for source, target in zip(sources, targets):
+                decoded = decoder.submit(self._timed, 'decode', self.read, source)
+                in_flight.append((filters.submit(self._filter, decoded), target))
+                if len(in_flight) >= self.queue_size:
+                    self._encode(*in_flight.popleft())
+            while in_flight:
+                self._encode(*in_flight.popleft())
+        self.stages['total']['frames'] = self.stages['encode']['frames']
+        self.stages['total']['seconds'] = time.perf_counter() - start
+        return self.report()
+
+    def report(self) -> dict:
+        """
+        Returns the number of frames, the busy seconds and the frames
+        per busy second for every stage, 'total' holds the wall time.
+        The filter stage sums the busy time of all its workers.
+        """
+        return {
+            stage: dict(values, frames_per_second=values['frames'] / values['seconds'] if values['seconds'] else 0.0)
+            for stage, values in self.stages.items()
+        }
+
+    def _filter(self, decoded) -> np.array:
+        return self._timed('filter', apply_filter, decoded.result(), self.kernel, self.method)
+
+    def _encode(self, filtered, target):
+        self._timed('encode', self.save, filtered.result(), target)
+
+    def _timed(self, stage: str, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        with self._lock:
+            self.stages[stage]['frames'] += 1
+            self.stages[stage]['seconds'] += time.perf_counter() - start
+        return result
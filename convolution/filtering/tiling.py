@@ -0,0 +1,96 @@
+"""
+Module Description: This module contains functions for memory-bounded image
+filtering, the image is processed in tiles overlapped by the kernel halo.
+"""
+import math
+import numpy as np
+from convolution.filtering.filtering import apply_filter, resolve_method
+
+# Default amount of memory a single tile may use, in bytes
+TILE_MEMORY_BUDGET = 64 << 20
+
+
+def halo_padding(kernel_size: int):
+    """
+    This function returns the number of rows (columns) the tile halo
+    needs above (left) and below (right) to follow the ceil-biased
+    zero padding of pad_image.
+    """
+    before = int(np.ceil((kernel_size - 1) / 2))
+    return before, kernel_size - 1 - before
+
+
+def tile_shape(image_shape, kernel_size: int, memory_budget: int, bytes_per_pixel: int):
+    """
+    This function returns the (rows, columns) of the tiles whose working
+    set fits into memory_budget. Tiles span the full image width whenever
+    at least one row more than the halo fits, which keeps reads from a
+    row-major np.memmap contiguous, otherwise square tiles are used.
+    """
+    pixels = max(1, memory_budget // bytes_per_pixel)
+    halo = kernel_size - 1
+    full_width_rows = pixels // (image_shape[1] + halo) - halo
+    if full_width_rows > 0:
+        return min(image_shape[0], full_width_rows), image_shape[1]
+    side = max(1, math.isqrt(pixels) - halo)
+    return min(image_shape[0], side), min(image_shape[1], side)
+
+
+def iter_tiles(image_shape, tile: tuple):
+    """
+    This function yields the (top, bottom, left, right) bounds of the
+    tiles covering an image, row by row.
+    """
+    for top in range(0, image_shape[0], tile[0]):
+        for left in range(0, image_shape[1], tile[1]):
+            yield top, min(top + tile[0], image_shape[0]), left, min(left + tile[1], image_shape[1])
+
+
+def read_tile(image: np.array, bounds: tuple, kernel_size: int) -> np.array:
+    """
+    This function copies a tile together with its halo out of the image,
+    the part of the halo outside the image is filled with zeros, exactly
+    as pad_image would have filled it.
+    """
+    top, bottom, left, right = bounds
+    before, after = halo_padding(kernel_size)
+    tile = np.zeros((bottom - top + kernel_size - 1, right - left + kernel_size - 1) + image.shape[2:], dtype=image.dtype)
+    rows = max(top - before, 0), min(bottom + after, image.shape[0])
+    columns = max(left - before, 0), min(right + after, image.shape[1])
+    tile[rows[0] - top + before:rows[1] - top + before, columns[0] - left + before:columns[1] - left + before] = \
+        image[rows[0]:rows[1], columns[0]:columns[1]]
+    return tile
+
+
+def filter_tile(image: np.array, kernel: np.array, method: str, bounds: tuple) -> np.array:
+    """
+    This function returns the filtered tile given by bounds, computed
+    from the tile and its halo only.
+    """
+    top, bottom, left, right = bounds
+    before = halo_padding(kernel.shape[0])[0]
+    filtered = apply_filter(read_tile(image, bounds, kernel.shape[0]), kernel, method)
+    return filtered[before:before + bottom - top, before:before + right - left]
+
+
+def apply_filter_tiled(image: np.array, kernel: np.array, method: str = 'auto', out: np.array = None,
+                       memory_budget: int = TILE_MEMORY_BUDGET) -> np.array:
+    """
+    This function performs the same convolution as apply_filter, but
+    tile by tile, so that only about memory_budget bytes are used on top
+    of the input and output. Both may be np.memmap arrays, then the image
+    is never loaded into memory as a whole.
+    """
+    method = resolve_method(image, kernel, method)
+    if out is None:
+        out = np.empty(image.shape, dtype=image.dtype)
+    assert out.shape == image.shape
+    channels = int(np.prod(image.shape[2:]))
+    # halo tile, its padded copy and the filtered tile, plus the spectra of the FFT backend
+    bytes_per_pixel = channels * (3 * image.itemsize + (48 if method == 'fft' else 16))
+    tile = tile_shape(image.shape, kernel.shape[0], memory_budget, bytes_per_pixel)
+    for bounds in iter_tiles(image.shape, tile):
+        out[bounds[0]:bounds[1], bounds[2]:bounds[3]] = filter_tile(image, kernel, method, bounds)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
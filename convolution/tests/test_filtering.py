@@ -2,15 +2,31 @@
 # -*- coding: utf-8 -*-
 import ast
 import inspect
+import json
+import tracemalloc
 from pathlib import Path
 import pytest
 from pylint.lint import Run
 from pylint.reporters import CollectingReporter
 from numpy.testing import assert_equal
 import numpy as np
-from convolution.filtering.helpers import read_image, identity_kernel, approx_gaussian_blur_5_kernel, edge_detection_kernel, \
-    roberts_cross_1_kernel, roberts_cross_2_kernel
-from convolution.filtering.filtering import apply_filter
+from PIL import Image
+from convolution.filtering.helpers import read_image, save_image, map_image, read_region, create_image, write_rows, identity_kernel, approx_gaussian_blur_5_kernel, edge_detection_kernel, \
+    roberts_cross_1_kernel, roberts_cross_2_kernel, filters
+from convolution.filtering.filtering import apply_filter, pad_image, calculate_sum, FFT_CROSSOVER, \
+    separable_factors, choose_method, apply_separable_filter, apply_filters, is_exactly_separable, integer_accumulator, \
+    FilterWorkspace, sliding_windows, correlate_windows, apply_filter_gray
+from convolution.filtering.calibration import calibrate_fft_crossover
+from convolution.filtering.tiling import apply_filter_tiled
+from convolution.filtering.parallel import apply_filter_parallel
+from convolution.filtering.streaming import StreamingFilter
+from convolution.filtering.pipeline import FilterPipeline, compose_kernels
+from convolution.filtering.borders import apply_filter_border
+from convolution.filtering.compiled import compile_filter
+from convolution.filtering.profiling import profile_filtering
+from convolution.filtering import filtering, helpers
+from convolution.filtering import compiled as compilation
+from convolution.benchmarks import benchmark_filtering
 
 
 @pytest.fixture(scope="session")
@@ -136,3 +152,431 @@ def test_roberts_cross_operator(image_gray, image_roberts_cross):
     assert_equal(
         apply_filter(apply_filter(image_gray, roberts_cross_1_kernel), roberts_cross_2_kernel),
         image_roberts_cross)
+
+
+def reference_filter(image, kernel):
+    """ Scalar reference built from pad_image and calculate_sum """
+    padded = pad_image(image, kernel.shape[0])
+    result = np.zeros(image.shape, dtype=image.dtype)
+    for i in range(image.shape[0]):
+        for j in range(image.shape[1]):
+            result[i, j] = calculate_sum(padded[i:i + kernel.shape[0], j:j + kernel.shape[0]], kernel)
+    return result
+
+
+@pytest.mark.parametrize("kernel", [
+    identity_kernel, approx_gaussian_blur_5_kernel, edge_detection_kernel, roberts_cross_1_kernel,
+    np.full((3, 3), 1 / 9), np.random.default_rng(0).normal(size=(4, 4)),
+])
+def test_vectorized_matches_scalar_sum(image_gray, kernel):
+    """ Test the window engine is bit-identical to the per-pixel calculate_sum loop """
+    crop = image_gray[200:240, 220:270]
+    assert_equal(apply_filter(crop, kernel), reference_filter(crop, kernel))
+    crop = crop.astype(np.float32)
+    assert_equal(apply_filter(crop, kernel), reference_filter(crop, kernel))
+
+
+@pytest.mark.parametrize("kernel", list(filters.values()) + [roberts_cross_1_kernel])
+def test_fft_matches_direct(image, kernel):
+    """ Test the FFT backend gives the same uint8 image as the direct sum """
+    assert_equal(apply_filter(image, kernel, 'fft'), apply_filter(image, kernel, 'direct'))
+
+
+def test_fft_crossover_calibration(image_gray):
+    """ Test the measured crossover is stored and used by method='auto' """
+    previous = FFT_CROSSOVER['kernel_size']
+    try:
+        kernel_size = calibrate_fft_crossover(image_size=32, kernel_sizes=[3, 5], repeats=1)
+        assert kernel_size in [3, 5, 6]
+        assert FFT_CROSSOVER['kernel_size'] == kernel_size
+    finally:
+        FFT_CROSSOVER['kernel_size'] = previous
+    blur = np.ones((15, 15)) / 256
+    assert_equal(apply_filter(image_gray, blur), apply_filter(image_gray, blur, 'fft'))
+    with pytest.raises(ValueError):
+        apply_filter(image_gray, blur, 'unknown')
+
+
+@pytest.mark.parametrize("kernel", [
+    np.ones((9, 9)) / 81, np.full((13, 13), 1 / 169), np.ones((9, 9)) * 2.0 ** -21,
+])
+def test_auto_avoids_inexact_fft(image_gray, kernel):
+    """ Test method='auto' does not use the FFT where it is not bit-identical to the direct sum """
+    images = [image_gray, image_gray.astype(float), image_gray.astype(np.uint16), np.full((30, 30), 100, dtype=np.uint8)]
+    for img in images:
+        assert choose_method(img, kernel) != 'fft'
+        assert_equal(apply_filter(img, kernel), apply_filter(img, kernel, 'direct'))
+    large = np.triu(np.ones((21, 21))) / 4096
+    assert choose_method(image_gray, large) == 'fft'
+    assert choose_method(image_gray.astype(float), large) != 'fft'
+    assert_equal(apply_filter(image_gray, large), apply_filter(image_gray, large, 'direct'))
+
+
+@pytest.mark.parametrize("name,separable", [
+    ('Identity', True), ('Sharpening', False), ('Gaussian blur 3x3 (approx)', True),
+    ('Gaussian blur 5x5 (approx)', True), ('Edge detection', False), ('Embossing', False),
+])
+def test_separable_filters(image, name, separable):
+    """ Test rank-1 detection and that the two 1-D passes match the 2-D sum """
+    kernel = filters[name]
+    factors = separable_factors(kernel)
+    assert (factors is not None) == separable
+    assert is_exactly_separable(image.dtype, kernel) == separable
+    if separable:
+        assert_equal(np.outer(*factors), kernel)
+        assert_equal(apply_filter(image, kernel, 'separable'), apply_filter(image, kernel, 'direct'))
+        assert_equal(apply_separable_filter(image, *factors), apply_filter(image, kernel, 'direct'))
+    else:
+        with pytest.raises(ValueError):
+            apply_filter(image, kernel, 'separable')
+
+
+def test_separable_tolerance():
+    """ Test nearly rank-1 kernels are split only with a positive tolerance """
+    kernel = approx_gaussian_blur_5_kernel + 1e-9 * np.eye(5)
+    assert separable_factors(kernel) is None
+    column, row = separable_factors(kernel, tolerance=1e-6)
+    assert np.abs(np.outer(column, row) - kernel).max() <= 1e-6
+    assert choose_method(np.zeros((4, 4), dtype=np.uint8), kernel) == 'direct'
+
+
+@pytest.mark.parametrize("method", ['direct', 'separable', 'fft'])
+def test_multichannel_single_pass(image, method):
+    """ Test channels convolved together equal channels convolved one by one """
+    result = apply_filter(image, approx_gaussian_blur_5_kernel, method)
+    assert result.dtype == image.dtype
+    for c in range(image.shape[2]):
+        assert_equal(result[:, :, c], apply_filter(np.ascontiguousarray(image[:, :, c]), approx_gaussian_blur_5_kernel, method))
+
+
+def test_multichannel_peak_memory():
+    """ Test peak memory stays close to input plus output for large RGB images """
+    large = np.random.default_rng(0).integers(0, 256, (1024, 1024, 3), dtype=np.uint8)
+    tracemalloc.start()
+    apply_filter(large, edge_detection_kernel, 'direct')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 3 * large.nbytes
+
+
+@pytest.mark.parametrize("method", ['direct', 'separable', 'fft'])
+@pytest.mark.parametrize("memory_budget", [1 << 16, 1 << 12, 1 << 30])
+def test_tiled_matches_untiled(image, method, memory_budget):
+    """ Test full-width, square and single tiles give the untiled result """
+    crop = image[:150, :170]
+    assert_equal(apply_filter_tiled(crop, approx_gaussian_blur_5_kernel, method, memory_budget=memory_budget),
+                 apply_filter(crop, approx_gaussian_blur_5_kernel, method))
+
+
+def test_tiled_memmap(image_gray, tmp_path):
+    """ Test tiled filtering from a memmap input into a memmap output """
+    source = np.lib.format.open_memmap(tmp_path / 'in.npy', mode='w+', dtype=np.uint8, shape=image_gray.shape)
+    source[...] = image_gray
+    target = np.lib.format.open_memmap(tmp_path / 'out.npy', mode='w+', dtype=np.uint8, shape=image_gray.shape)
+    result = apply_filter_tiled(source, roberts_cross_1_kernel, out=target, memory_budget=1 << 16)
+    assert result is target
+    assert_equal(np.load(tmp_path / 'out.npy'), apply_filter(image_gray, roberts_cross_1_kernel))
+
+
+@pytest.mark.parametrize("method", ['direct', 'separable', 'fft'])
+@pytest.mark.parametrize("workers", [1, 3, 8])
+def test_parallel_matches_serial(image, method, workers):
+    """ Test row bands filtered in a thread pool give the serial result """
+    assert_equal(apply_filter_parallel(image, approx_gaussian_blur_5_kernel, method, workers=workers),
+                 apply_filter(image, approx_gaussian_blur_5_kernel, method))
+    tiny = image[:5, :7, 0]
+    out = np.empty_like(tiny)
+    assert apply_filter_parallel(tiny, edge_detection_kernel, out=out, workers=workers) is out
+    assert_equal(out, apply_filter(tiny, edge_detection_kernel))
+    with pytest.raises(AssertionError):
+        apply_filter_parallel(tiny, edge_detection_kernel, out=out[1:], workers=workers)
+
+
+def test_apply_filters_shared_padding(image, image_gray):
+    """ Test one pass over all kernels equals one apply_filter call per kernel """
+    results = apply_filters(image, filters)
+    assert list(results) == list(filters)
+    for name, kernel in filters.items():
+        assert_equal(results[name], apply_filter(image, kernel, 'direct'))
+    kernels = [roberts_cross_1_kernel, approx_gaussian_blur_5_kernel, np.random.default_rng(0).normal(size=(4, 4))]
+    stacked = apply_filters(image_gray, kernels)
+    assert stacked.shape == (3,) + image_gray.shape
+    for result, kernel in zip(stacked, kernels):
+        assert_equal(result, apply_filter(image_gray, kernel, 'direct'))
+
+
+def test_apply_filters_backends(image_gray, monkeypatch):
+    """ Test every kernel of apply_filters runs the backend apply_filter would choose """
+    kernels = list(filters.values()) + [np.triu(np.ones((21, 21))) / 4096, np.ones((9, 9)) / 81]
+    used = []
+    rows_correlator = filtering.rows_correlator
+    monkeypatch.setattr(filtering, 'rows_correlator', lambda kernel, method, *args: used.append(method) or
+                        rows_correlator(kernel, method, *args))
+    stacked = apply_filters(image_gray, kernels)
+    expected = [choose_method(image_gray, kernel) for kernel in kernels]
+    assert {'fft', 'integer', 'direct'} <= set(expected)
+    assert used == [method for method in expected if method != 'fft']
+    for result, kernel in zip(stacked, kernels):
+        assert_equal(result, apply_filter(image_gray, kernel))
+    for result, kernel in zip(apply_filters(image_gray, kernels, 'direct'), kernels):
+        assert_equal(result, apply_filter(image_gray, kernel, 'direct'))
+
+
+@pytest.mark.parametrize("workers,queue_size", [(1, 1), (2, 3)])
+def test_streaming_filter(image, tmp_path, workers, queue_size):
+    """ Test the streaming pipeline filters every frame in order and reports each stage """
+    frames = [np.roll(image[:64, :80], shift, axis=1) for shift in range(5)]
+    sources = [tmp_path / f'in_{i}.png' for i in range(len(frames))]
+    targets = [tmp_path / f'out_{i}.png' for i in range(len(frames))]
+    for frame, source in zip(frames, sources):
+        save_image(frame, source)
+    report = StreamingFilter(edge_detection_kernel, workers=workers, queue_size=queue_size).run(sources, targets)
+    for frame, target in zip(frames, targets):
+        assert_equal(read_image(target), apply_filter(frame, edge_detection_kernel))
+    assert all(report[stage]['frames'] == len(frames) for stage in ['decode', 'filter', 'encode', 'total'])
+    assert report['total']['frames_per_second'] > 0
+    with pytest.raises(FileNotFoundError):
+        StreamingFilter(edge_detection_kernel).run([tmp_path / 'missing.png'], [tmp_path / 'never.png'])
+
+
+@pytest.mark.parametrize("name", list(filters))
+def test_integer_matches_direct(image, image_gray, name):
+    """ Test the int16/int32 fixed-point sums are bit-exact with the float64 sums """
+    kernel = filters[name]
+    assert integer_accumulator(image.dtype, kernel) is not None
+    assert choose_method(image, kernel) == 'integer'
+    assert_equal(apply_filter(image, kernel, 'integer'), apply_filter(image, kernel, 'direct'))
+    assert_equal(apply_filter(image_gray, kernel, 'integer'), apply_filter(image_gray, kernel, 'direct'))
+
+
+def test_integer_not_applicable(image_gray):
+    """ Test the integer backend refuses float images and non fixed-point kernels """
+    assert integer_accumulator(np.float64, edge_detection_kernel) is None
+    assert integer_accumulator(np.uint8, np.full((3, 3), 1 / 9)) is None
+    assert choose_method(image_gray, np.full((3, 3), 1 / 9)) == 'direct'
+    with pytest.raises(ValueError):
+        apply_filter(image_gray, np.full((3, 3), 1 / 9), 'integer')
+
+
+def test_benchmark_regression_tracking(tmp_path):
+    """ Test the benchmark harness stores JSON results and flags slowdowns against a baseline """
+    arguments = ['--sizes', '16', '--kernel-sizes', '2', '5', '--channels', '1', '3', '--dtypes', 'uint8',
+                 '--methods', 'auto', 'integer', '--repeats', '1']
+    assert benchmark_filtering.main(arguments + ['--output', str(tmp_path / 'baseline.json')]) == 0
+    stored = json.loads((tmp_path / 'baseline.json').read_text(encoding='utf-8'))
+    assert len(stored['results']) == 2 * 2 * 3
+    for result in stored['results']:
+        result['seconds'] *= 1e6
+    (tmp_path / 'slow.json').write_text(json.dumps(stored), encoding='utf-8')
+    assert benchmark_filtering.main(arguments + ['--baseline', str(tmp_path / 'slow.json')]) == 0
+    for result in stored['results']:
+        result['seconds'] /= 1e12
+    (tmp_path / 'fast.json').write_text(json.dumps(stored), encoding='utf-8')
+    assert benchmark_filtering.main(arguments + ['--baseline', str(tmp_path / 'fast.json')]) == 1
+    assert not benchmark_filtering.compare(stored['results'], stored['results'], threshold=1.0)
+
+
+@pytest.mark.parametrize("kernels", [
+    [filters['Gaussian blur 3x3 (approx)'], edge_detection_kernel, filters['Sharpening']],
+    [approx_gaussian_blur_5_kernel, roberts_cross_1_kernel, np.full((4, 4), 1 / 7)],
+])
+def test_pipeline_matches_chain(image, image_gray, kernels):
+    """ Test a tiled filter chain is bit-identical to calling apply_filter kernel by kernel """
+    for img in [image, image_gray]:
+        expected = img
+        for kernel in kernels:
+            expected = apply_filter(expected, kernel)
+        pipeline = FilterPipeline(memory_budget=1 << 15)
+        for kernel in kernels:
+            pipeline.then(kernel)
+        assert len(pipeline.stages(img)) == len(kernels)
+        assert_equal(pipeline.apply(img), expected)
+
+
+def test_pipeline_fuses_range_preserving_kernels(image):
+    """ Test range preserving kernels are pre-convolved for float images, the borders included """
+    box = np.full((2, 2), 0.25)
+    assert compose_kernels(box, box).shape == (4, 4)
+    for kernels, stages in [([filters['Gaussian blur 3x3 (approx)'], approx_gaussian_blur_5_kernel, edge_detection_kernel], 2),
+                            ([box, box, roberts_cross_1_kernel], 2), ([edge_detection_kernel, box], 2),
+                            ([np.array([[0.5]]), np.array([[0.5]])], 1)]:
+        expected = image.astype(float)
+        for kernel in kernels:
+            expected = apply_filter(expected, kernel)
+        pipeline = FilterPipeline(kernels, memory_budget=1 << 15)
+        assert len(pipeline.stages(image.astype(float))) == stages
+        assert np.allclose(pipeline.apply(image.astype(float)), expected)
+        assert len(pipeline.stages(image)) == len(pipeline.stages(image.astype(float) * 2)) == len(kernels)
+
+
+def test_workspace_reuses_buffers(image, image_gray):
+    """ Test out= and a FilterWorkspace give the same results and repeated calls allocate no image-sized buffers """
+    workspace = FilterWorkspace()
+    for img in [image, image_gray]:
+        out = np.empty_like(img)
+        for kernel in [edge_detection_kernel, approx_gaussian_blur_5_kernel, roberts_cross_1_kernel]:
+            for method in ['direct', 'auto']:
+                assert workspace.apply_filter(img, kernel, method, out) is out
+                assert_equal(out, apply_filter(img, kernel, method))
+                tracemalloc.start()
+                workspace.apply_filter(img, kernel, method, out)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                assert peak < img.nbytes
+    padded = np.full((5, 6, 3), 7, dtype=np.uint8)
+    assert pad_image(image[:3, :4], 3, np.uint8, padded) is padded
+    assert_equal(padded, pad_image(image[:3, :4], 3, np.uint8))
+
+
+@pytest.mark.parametrize("mode, numpy_mode", [('reflect', 'reflect'), ('replicate', 'edge'), ('wrap', 'wrap')])
+def test_border_modes(image, image_gray, mode, numpy_mode):
+    """ Test the border modes match correlating an image padded by numpy.pad, without a padded copy """
+    rng = np.random.default_rng(0)
+    for img in [image, image_gray, image[:3, :5], image_gray[:1, :7]]:
+        for kernel in [edge_detection_kernel, approx_gaussian_blur_5_kernel, roberts_cross_1_kernel, rng.random((9, 9)) / 40]:
+            before = int(np.ceil((kernel.shape[0] - 1) / 2))
+            padding = [(before, kernel.shape[0] - 1 - before)] * 2 + [(0, 0)] * (img.ndim - 2)
+            windows = sliding_windows(np.pad(img, padding, mode=numpy_mode), kernel.shape[0])
+            expected = correlate_windows(windows, kernel).astype(img.dtype)
+            for method in ['direct', 'auto', 'fft']:
+                assert_equal(apply_filter_border(img, kernel, mode, method), expected)
+    tracemalloc.start()
+    apply_filter_border(image, approx_gaussian_blur_5_kernel, mode)
+    border_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    apply_filter(image, approx_gaussian_blur_5_kernel)
+    zero_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # no padded copy: the border mode costs no more memory than the zero padding
+    assert border_peak <= zero_peak
+    assert_equal(apply_filter_border(image, edge_detection_kernel, 'zero'), apply_filter(image, edge_detection_kernel))
+    with pytest.raises(ValueError):
+        apply_filter_border(image, edge_detection_kernel, 'mirror')
+
+
+@pytest.mark.parametrize("name", list(filters))
+def test_filter_gray_matches_two_steps(image, image_gray, name):
+    """ Test the fused luma conversion and filtering equals converting with np.average first """
+    for method in ['direct', 'auto', 'fft']:
+        assert_equal(apply_filter_gray(image, filters[name], method), apply_filter(image_gray, filters[name], method))
+    colors = np.random.default_rng(0).integers(0, 256, (61, 83, 3)).astype(np.uint8)
+    gray = np.average(colors.astype(float), weights=[0.299, 0.587, 0.114], axis=2).astype(np.uint8)
+    assert_equal(apply_filter_gray(colors, filters[name]), apply_filter(gray, filters[name]))
+
+
+@pytest.mark.parametrize("name", list(filters))
+def test_compiled_filter_matches_apply_filter(image, image_gray, name):
+    """ Test compiled filters are memoized by kernel content and equal apply_filter for every backend """
+    kernel = filters[name]
+    assert compile_filter(kernel) is compile_filter(kernel.copy())
+    assert compile_filter(kernel) is not compile_filter(kernel, 'direct')
+    for method in ['auto', 'direct', 'fft']:
+        compiled = compile_filter(kernel, method)
+        for img in [image, image_gray, image[:31, :17], image_gray.astype(float)[:40, :50]]:
+            for _ in range(2):
+                assert_equal(compiled.apply(img), apply_filter(img, kernel, method))
+    changed = kernel.copy()
+    compiled = compile_filter(changed)
+    changed += 1
+    assert_equal(compiled.apply(image), apply_filter(image, kernel))
+
+
+def test_compiled_filter_bounded_caches(image):
+    """ Test a compiled filter holds one buffer per name and a bounded number of spectra over many crop sizes """
+    for method in ['auto', 'fft']:
+        compiled = compilation.CompiledFilter(approx_gaussian_blur_5_kernel, method)
+        for size in range(20, 60):
+            crop = image[:size, :size + 7]
+            assert_equal(compiled.apply(crop), apply_filter(crop, approx_gaussian_blur_5_kernel, method))
+        assert len(compiled.spectra) <= compilation.COMPILED_SPECTRA_LIMIT
+        workspace = compiled._local.workspace  # pylint: disable=protected-access
+        assert len(workspace.buffers) <= 3
+        assert sum(buffer.nbytes for buffer in workspace.buffers.values()) < 16 * crop.nbytes
+
+
+@pytest.mark.parametrize("name", list(filters))
+def test_batched_filter(image, name):
+    """ Test a 4-D batch is filtered in one call exactly as image by image """
+    kernel = filters[name]
+    crops = np.stack([image[top:top + 40, left:left + 56] for top in range(0, 400, 100) for left in range(0, 400, 150)])
+    for batch in [crops, crops[..., :1], crops.astype(float)]:
+        for method in ['auto', 'direct', 'fft']:
+            expected = np.stack([apply_filter(crop, kernel, method) for crop in batch])
+            assert_equal(apply_filter(batch, kernel, method), expected)
+            assert_equal(compile_filter(kernel, method).apply(batch), expected)
+    for method in ['auto', 'direct', 'fft']:
+        empty = np.zeros((0,) + crops.shape[1:], dtype=crops.dtype)
+        assert apply_filter(empty, kernel, method).shape == empty.shape
+        assert compile_filter(kernel, method).apply(empty).shape == empty.shape
+
+
+@pytest.mark.parametrize("suffix", ['.tif', '.npy', '.raw'])
+def test_mapped_image_io(image, image_gray, tmp_path, suffix):
+    """ Test images streamed to disk row by row are memory-mapped back and filtered tile by tile """
+    for img in [image, image_gray]:
+        source, target = tmp_path / ('source' + suffix), tmp_path / ('target' + suffix)
+        write_rows(source, img.shape, (img[top:top + 100] for top in range(0, img.shape[0], 100)))
+        mapped = map_image(source, img.shape if suffix == '.raw' else None)
+        assert isinstance(mapped, np.memmap)
+        assert_equal(mapped, img)
+        assert_equal(read_region(source, (10, 50, 20, 90)) if suffix != '.raw' else mapped[10:50, 20:90], img[10:50, 20:90])
+        out = create_image(target, img.shape)
+        apply_filter_tiled(mapped, approx_gaussian_blur_5_kernel, out=out, memory_budget=1 << 16)
+        del out
+        filtered = map_image(target, img.shape if suffix == '.raw' else None)
+        assert_equal(filtered, apply_filter(img, approx_gaussian_blur_5_kernel))
+        if suffix == '.tif':
+            assert_equal(read_image(target), filtered)
+    assert_equal(read_region('lenna.png', (10, 50, 20, 90)), image[10:50, 20:90])
+    with pytest.raises(ValueError):
+        map_image('lenna.png')
+
+
+def test_bigtiff_image_io(image, tmp_path, monkeypatch):
+    """ Test images past the 32-bit TIFF offsets are written as BigTIFF and memory-mapped back """
+    monkeypatch.setattr(helpers, 'TIFF_OFFSET_LIMIT', 1 << 16)
+    rgba = np.dstack([image, image[..., :1]])
+    for img in [image, image[..., 0], rgba]:
+        target = tmp_path / 'big.tif'
+        out = create_image(target, img.shape)
+        out[...] = img
+        del out
+        assert target.read_bytes()[:4] == b'II+\x00'
+        assert_equal(map_image(target), img)
+        with Image.open(target) as decoded:
+            assert_equal(np.asarray(decoded), img)
+
+
+def test_profiling_hooks(image, image_gray):
+    """ Test the profiler records every stage while active and leaves the filtering module untouched afterwards """
+    functions = {name: getattr(filtering, name) for name in ['correlate', 'pad_image', 'sum_windows', 'correlate_fft']}
+    with profile_filtering() as profile:
+        filtered = apply_filter(image, approx_gaussian_blur_5_kernel, 'direct')
+        apply_filter(image_gray, edge_detection_kernel, 'fft')
+    assert all(getattr(filtering, name) is function for name, function in functions.items())
+    assert_equal(filtered, apply_filter(image, approx_gaussian_blur_5_kernel, 'direct'))
+    report = profile.report()
+    assert report['filter']['calls'] == 2 and report['filter']['channels'] == 4
+    assert report['pad']['calls'] == 1 and report['pad']['bytes'] == 516 * 516 * 3
+    assert report['fft']['calls'] == 1 and report['sums']['calls'] > 0
+    assert report['filter']['seconds'] >= report['sums']['seconds'] > 0
+    assert 'convolution_filtering_calls_total{stage="filter"} 2' in profile.prometheus().splitlines()
+
+
+def test_profiling_overlapping_blocks(image):
+    """ Test overlapping profiling blocks share the hooks and restore the module when the last one ends """
+    functions = {name: getattr(filtering, name) for name in ['correlate', 'correlate_bands', 'pad_image']}
+    first, second = profile_filtering(), profile_filtering()
+    outer = first.__enter__()
+    inner = second.__enter__()
+    apply_filter_parallel(image, approx_gaussian_blur_5_kernel, 'direct', workers=2)
+    first.__exit__(None, None, None)
+    assert filtering.pad_image is not functions['pad_image']
+    compile_filter(edge_detection_kernel).apply(image)
+    apply_filter(image[np.newaxis].repeat(2, axis=0), identity_kernel)
+    second.__exit__(None, None, None)
+    assert all(getattr(filtering, name) is function for name, function in functions.items())
+    report = outer.report()
+    assert report['filter']['calls'] == 2 and report['filter']['channels'] == 6 and report['pad']['calls'] == 1
+    report = inner.report()
+    assert report['filter']['calls'] == 4 and report['filter']['channels'] == 15 and report['pad']['calls'] == 3
@@ -2,13 +2,17 @@
 Module Description: This module contains functions for math.
 """
 
+import functools
+import hashlib
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from typing import Tuple
 import cv2
 import numpy as np
 
-from orb_detector.utils import apply_gaussian_2d
+from orb_detector.utils import apply_gaussian_2d_stack, get_gaussian_kernel
 
 PER_GROUP_COUNT = 9
 MAX_PIXEL_VALUE = 255
@@ -18,6 +22,16 @@ FAST_COL_OFFSETS = [0, 1, 2, 3, 3, 3, 2, 1, 0, -1, -2, -3, -3, -3, -2, -1]
 FAST_FIRST_TEST_INDICES = [0, 4, 8, 12]
 FAST_FIRST_TEST_THRESHOLD = 3
 FAST_SECOND_TEST_THRESHOLD = 12
+FAST_ARC_CODES = 1 << len(FAST_ROW_OFFSETS)
+HARRIS_SIGMA = 1.0
+HARRIS_K = 0.05
+# Share of the image the candidate patches may cover before filter_keypoints
+# computes the dense Harris response instead of the sparse one
+HARRIS_SPARSE_MAX_COVERAGE = 1.0
+# Number of pyramids get_pyramid() keeps for images seen again
+PYRAMID_CACHE_LIMIT = 8
+PYRAMID_CACHE = {}
+PYRAMID_CACHE_LOCK = threading.Lock()
 
 
 def create_pyramid(
@@ -56,13 +70,206 @@ def create_pyramid(
     return pyramid
 
 
+def pyramid_shapes(
+        shape: Tuple[int, ...], n_pyr_layers: int, downscale_factor: float = 1.2
+) -> List[Tuple[int, ...]]:
+    """
+    Returns the shapes of the levels create_pyramid() creates for an image of the given shape.
+    """
+    shapes = [tuple(shape)]
+    for _ in range(1, n_pyr_layers):
+        height, width = shapes[-1][:2]
+        shapes.append((math.ceil(height / downscale_factor), math.ceil(width / downscale_factor)) + shapes[-1][2:])
+    return shapes
+
+
+class Pyramid:
+    """
+    Multi-scale image pyramid whose levels are resized only when they are first used.
+
+    The levels equal those of create_pyramid(), but all of them are read-only views
+    into one buffer preallocated for the whole pyramid (the first level holds a copy
+    of the image), so a pyramid can be shared between calls and threads.
+
+    Parameters
+    ----------
+    img_pyr : np.ndarray
+        Gray-scaled input image.
+    n_pyr_layers : int
+        Number of layers in the pyramid.
+    downscale_factor: float
+        Downscaling performed between successive pyramid layers.
+    """
+
+    def __init__(self, img_pyr: np.ndarray, n_pyr_layers: int, downscale_factor: float = 1.2):
+        self.downscale_factor = downscale_factor
+        self.shapes = pyramid_shapes(img_pyr.shape, n_pyr_layers, downscale_factor)
+        sizes = [math.prod(shape) for shape in self.shapes]
+        self.buffer = np.empty(sum(sizes), dtype=img_pyr.dtype)
+        starts = np.cumsum([0] + sizes[:-1])
+        self._levels = [self.buffer[start:start + size].reshape(shape) for start, size, shape in zip(starts, sizes, self.shapes)]
+        self._levels[0][...] = img_pyr
+        self._levels[0].flags.writeable = False
+        self._n_resized = 1
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def __getitem__(self, level: int) -> np.ndarray:
+        return self.level(level)
+
+    def __iter__(self):
+        return (self.level(level) for level in range(len(self)))
+
+    def level(self, level: int) -> np.ndarray:
+        """
+        Returns the image of the level, resizing the levels up to it if not done yet.
+        """
+        level = range(len(self))[level]
+        with self._lock:
+            while self._n_resized <= level:
+                previous, current = self._levels[self._n_resized - 1], self._levels[self._n_resized]
+                cv2.resize(previous, (current.shape[1], current.shape[0]), dst=current)
+                current.flags.writeable = False
+                self._n_resized += 1
+        return self._levels[level]
+
+    def levels(self) -> List[np.ndarray]:
+        """
+        Returns the images of all levels.
+        """
+        return list(self)
+
+
+def get_pyramid(
+        img_pyr: np.ndarray, n_pyr_layers: int, downscale_factor: float = 1.2
+) -> Pyramid:
+    """
+    Returns the Pyramid of the image, reusing the pyramid of an earlier call.
+
+    The last PYRAMID_CACHE_LIMIT pyramids are kept, keyed by a hash of the image
+    data (with its shape and dtype), the downscale factor and the number of layers,
+    so detecting again on the same frame, e.g. with another threshold, skips the
+    pyramid construction.
+
+    Parameters
+    ----------
+    img_pyr : np.ndarray
+        Gray-scaled input image.
+    n_pyr_layers : int
+        Number of layers in the pyramid.
+    downscale_factor: float
+        Downscaling performed between successive pyramid layers.
+
+    Returns
+    -------
+    pyr : Pyramid
+        Pyramid of scaled images.
+    """
+    digest = hashlib.sha256(np.ascontiguousarray(img_pyr).data).hexdigest()
+    key = (digest, img_pyr.shape, img_pyr.dtype.str, downscale_factor, n_pyr_layers)
+    with PYRAMID_CACHE_LOCK:
+        # reinserting keeps the dict ordered from the least to the most recently used
+        pyramid = PYRAMID_CACHE.pop(key, None)
+        if pyramid is None:
+            if len(PYRAMID_CACHE) >= PYRAMID_CACHE_LIMIT:
+                del PYRAMID_CACHE[next(iter(PYRAMID_CACHE))]
+            pyramid = Pyramid(img_pyr, n_pyr_layers, downscale_factor)
+        PYRAMID_CACHE[key] = pyramid
+    return pyramid
+
+
+def circle_pixels(
+        img_level: np.ndarray, rows: np.ndarray, cols: np.ndarray, indices=None
+) -> np.ndarray:
+    """
+    Gathers the pixels on the Bresenham circle around the given centers.
+
+    Parameters
+    ----------
+    img_level : np.ndarray
+        Image at the given level of the image pyramid.
+    rows, cols : np.ndarray
+        Row and column indices of the N circle centers.
+    indices : Sequence[int]
+        Positions on the circle to gather, all 16 by default.
+
+    Returns
+    -------
+    circle : np.ndarray
+        (N, len(indices)) array of the circle pixels of every center.
+    """
+    indices = range(len(FAST_ROW_OFFSETS)) if indices is None else indices
+    row_offsets, col_offsets = np.take(FAST_ROW_OFFSETS, indices), np.take(FAST_COL_OFFSETS, indices)
+    return img_level[np.add.outer(rows, row_offsets), np.add.outer(cols, col_offsets)]
+
+
+def circle_comparisons(
+        center: np.ndarray, circle: np.ndarray, threshold: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compares center pixels with their circle pixels (along the last axis of circle).
+
+    Returns
+    -------
+    darker, brighter : np.ndarray
+        Boolean arrays of the shape of circle, True where the center is darker
+        (brighter) than the circle pixel by more than the threshold. A pixel is
+        tested for darker first, so it is never counted as both.
+    """
+    darker = center[..., np.newaxis] < circle - threshold
+    brighter = (center[..., np.newaxis] > circle + threshold) & ~darker
+    return darker, brighter
+
+
+@functools.lru_cache(maxsize=None)
+def arc_lookup_table(arc_length: int) -> np.ndarray:
+    """
+    Returns the lookup table of the contiguous-arc segment test.
+
+    Bit i of a 16-bit code stands for the circle pixel i (in the order of
+    FAST_ROW_OFFSETS), the table holds for all FAST_ARC_CODES codes whether
+    the set bits contain a contiguous arc (wrapping around) of arc_length pixels.
+
+    Parameters
+    ----------
+    arc_length : int
+        Length of the arc, 9 for FAST-9 and 12 for FAST-12.
+
+    Returns
+    -------
+    table : np.ndarray
+        Read-only boolean array of FAST_ARC_CODES entries.
+    """
+    if not 1 <= arc_length <= len(FAST_ROW_OFFSETS):
+        raise ValueError(f'Arc length must be between 1 and {len(FAST_ROW_OFFSETS)}, got {arc_length}.')
+    bits = (np.arange(FAST_ARC_CODES)[:, np.newaxis] >> np.arange(len(FAST_ROW_OFFSETS))) & 1 == 1
+    arcs = bits.copy()
+    for shift in range(1, arc_length):
+        arcs &= np.roll(bits, -shift, axis=1)
+    table = arcs.any(axis=1)
+    table.flags.writeable = False
+    return table
+
+
+def circle_codes(comparisons: np.ndarray) -> np.ndarray:
+    """
+    Packs the (N, 16) boolean circle comparisons into N 16-bit codes for arc_lookup_table().
+    """
+    return np.packbits(comparisons, axis=1, bitorder='little').view('<u2')[:, 0]
+
+
 # not necessary to implement, see README
 def get_first_test_mask(
-        img_level: np.ndarray, threshold: int, border: int
+        img_level: np.ndarray, threshold: int, border: int, min_count: int = FAST_FIRST_TEST_THRESHOLD
 ) -> np.ndarray:
     """
     Returns the mask from the first FAST test (FAST_FIRST_TEST_INDICES).
 
+    The four circle pixels of all pixels are compared at once through
+    shifted views of the image.
+
     Parameters
     ----------
     img_level : np.ndarray
@@ -71,6 +278,8 @@ def get_first_test_mask(
         Intensity by which tested pixel should differ from the pixels on its Bresenham circle.
     border: int
         Number of rows/columns at the image border where no keypoints should be reported.
+    min_count: int
+        Number of the four pixels which must all be darker or all brighter.
 
     Returns
     -------
@@ -78,19 +287,20 @@ def get_first_test_mask(
         Boolean mask with True values at pixels which pass the first FAST test.
     """
     img_level = img_level.astype(int)
-    mask = np.zeros((img_level.shape[0], img_level.shape[1]))
-    for row in range(border, img_level.shape[0] - border, 1):
-        for col in range(border, img_level.shape[1] - border, 1):  # here we get a specific center pixel
-            lighter_intensity_count, darker_intensity_count = 0, 0
-            for i in FAST_FIRST_TEST_INDICES:  # going through first test indices
-                center_pixel = img_level[row][col]
-                pixel_cmp_center_to = img_level[row + FAST_ROW_OFFSETS[i]][col + FAST_COL_OFFSETS[i]]
-                if center_pixel < pixel_cmp_center_to - threshold:
-                    darker_intensity_count += 1
-                elif center_pixel > pixel_cmp_center_to + threshold:
-                    lighter_intensity_count += 1
-            if lighter_intensity_count >= FAST_FIRST_TEST_THRESHOLD or darker_intensity_count >= FAST_FIRST_TEST_THRESHOLD:
-                mask[row][col] = 1
+    border = max(border, FAST_CIRCLE_RADIUS)
+    height, width = img_level.shape
+    mask = np.zeros((height, width))
+    if height <= 2 * border or width <= 2 * border:
+        return mask
+    center = img_level[border:height - border, border:width - border]
+    circle = np.stack([
+        img_level[border + FAST_ROW_OFFSETS[i]:height - border + FAST_ROW_OFFSETS[i],
+                  border + FAST_COL_OFFSETS[i]:width - border + FAST_COL_OFFSETS[i]]
+        for i in FAST_FIRST_TEST_INDICES
+    ], axis=-1)
+    darker, brighter = circle_comparisons(center, circle, threshold)
+    mask[border:height - border, border:width - border] = \
+        (darker.sum(axis=-1) >= min_count) | (brighter.sum(axis=-1) >= min_count)
     return mask
 
 
@@ -99,11 +309,20 @@ def get_second_test_mask(
         img_level: np.ndarray,
         first_test_mask: np.ndarray,
         threshold: int,
+        arc_length: int = None,
 ) -> np.ndarray:
     """
     Returns the mask from the second FAST test (FAST_FIRST_TEST_INDICES).
     HINT: test only at those points which already passed the first test (first_test_mask).
 
+    The 16 circle pixels of all points which passed the first test are
+    gathered into one (N, 16) array and compared at once. By default a point
+    passes if at least FAST_SECOND_TEST_THRESHOLD circle pixels are darker (or
+    brighter) anywhere on the circle. With arc_length, it passes the standard
+    FAST segment test instead: the darker (or brighter) pixels must form a
+    contiguous arc of arc_length pixels, looked up by their 16-bit code in
+    arc_lookup_table().
+
     Parameters
     ----------
     img_level : np.ndarray
@@ -112,6 +331,8 @@ def get_second_test_mask(
         Boolean mask for the first test, which was created by get_first_test_mask().
     threshold : int
         Intensity by which tested pixel should differ from the pixels on its Bresenham circle.
+    arc_length: int
+        Length of the contiguous arc (9 for FAST-9, 12 for FAST-12), None for counting.
 
     Returns
     -------
@@ -120,23 +341,13 @@ def get_second_test_mask(
     """
     img_level = img_level.astype(int)
     mask = np.zeros((img_level.shape[0], img_level.shape[1]))
-    for row in range(first_test_mask.shape[0]):
-        for col in range(first_test_mask.shape[1]):  # here we get a specific center pixel
-            if first_test_mask[row][col] != 1:
-                continue
-
-            lighter_intensity_count, darker_intensity_count = 0, 0
-            for i, j in zip(FAST_ROW_OFFSETS, FAST_COL_OFFSETS):  # going through first test indices
-                center_pixel = img_level[row][col]
-                pixel_cmp_center_to = img_level[row + i][col + j]
-                if center_pixel < pixel_cmp_center_to - threshold:
-                    darker_intensity_count += 1
-                elif center_pixel > pixel_cmp_center_to + threshold:
-                    lighter_intensity_count += 1
-            if lighter_intensity_count >= FAST_SECOND_TEST_THRESHOLD or darker_intensity_count >= FAST_SECOND_TEST_THRESHOLD:
-                mask[row][col] = 1
-            else:
-                mask[row][col] = 0
+    rows, cols = np.nonzero(first_test_mask == 1)
+    darker, brighter = circle_comparisons(img_level[rows, cols], circle_pixels(img_level, rows, cols), threshold)
+    if arc_length is None:
+        mask[rows, cols] = (darker.sum(axis=1) >= FAST_SECOND_TEST_THRESHOLD) | (brighter.sum(axis=1) >= FAST_SECOND_TEST_THRESHOLD)
+    else:
+        table = arc_lookup_table(arc_length)
+        mask[rows, cols] = table[circle_codes(darker)] | table[circle_codes(brighter)]
     return mask
 
 
@@ -147,6 +358,11 @@ def calculate_kp_scores(
     """
     Calculates FAST score for initial keypoints.
 
+    The score is the largest of the smallest absolute differences between
+    the keypoint and the PER_GROUP_COUNT pixels of each contiguous group on
+    its circle. The circle pixels of all keypoints are gathered into one
+    (N, 16) array and all 16 groups are taken as windows of it at once.
+
     Parameters
     ----------
     img_level : np.ndarray
@@ -159,28 +375,23 @@ def calculate_kp_scores(
     scores : List[int]
         Scores for the tentative keypoints.
     """
+    if len(keypoints) == 0:
+        return []
     img_level = img_level.astype(int)
-    scores = []
-    for keypoint_row, keypoint_col in keypoints:  # iterating through all key points
-        array_groups_lowest_diffs = []  # array for storing the lowest values of groups for the keypoint
-        center_pixel = img_level[keypoint_row][keypoint_col]
-        for group_offset in range(len(FAST_COL_OFFSETS)):  # iterating through all 16 groups we can get in an array
-            group_lowest_diff = MAX_PIXEL_VALUE
-            offset_row_arr = np.roll(FAST_ROW_OFFSETS, group_offset)
-            offset_col_arr = np.roll(FAST_COL_OFFSETS, group_offset)
-            for i in range(PER_GROUP_COUNT):  # iterating though 9 elements which create a group
-                current_pixel_cmp_to = img_level[keypoint_row + offset_row_arr[i]][keypoint_col + offset_col_arr[i]]
-                if np.abs(center_pixel - current_pixel_cmp_to) < group_lowest_diff:
-                    group_lowest_diff = np.abs(center_pixel - current_pixel_cmp_to)
-            array_groups_lowest_diffs.append(group_lowest_diff)
-        scores.append(int(max(array_groups_lowest_diffs)))
-    return scores
+    rows, cols = np.asarray(keypoints).T
+    diffs = np.abs(img_level[rows, cols][:, np.newaxis] - circle_pixels(img_level, rows, cols))
+    # the groups wrap around the circle, so the windows run over the circle followed by its start
+    groups = np.lib.stride_tricks.sliding_window_view(
+        np.concatenate([diffs, diffs[:, :PER_GROUP_COUNT - 1]], axis=1), PER_GROUP_COUNT, axis=1
+    )
+    return groups.min(axis=2).max(axis=1).tolist()
 
 
 def detect_keypoints(
         img_level: np.ndarray,
         threshold: int,
         border: int = 0,
+        arc_length: int = None,
 ) -> Tuple[List[Tuple[int, int]], List[int]]:
     """
     Creates the initial keypoints list.
@@ -196,6 +407,9 @@ def detect_keypoints(
         Intensity by which tested pixel should differ from the pixels on its Bresenham circle.
     border: int
         Number of rows/columns at the image border where no keypoints should be reported.
+    arc_length: int
+        Contiguous arc length of the FAST segment test (9 or 12), None for the
+        default counting test, see get_second_test_mask().
 
     Returns
     -------
@@ -205,75 +419,15 @@ def detect_keypoints(
         Corresponding scores calculate with calculate_kp_scores().
     """
     border = max(border, FAST_CIRCLE_RADIUS)
-    keypoints, scores = [], []
-    first_test_mask = get_first_test_mask(img_level, threshold, border)
-    second_test_mask = get_second_test_mask(img_level, first_test_mask, threshold)
-    for row in range(second_test_mask.shape[0]):
-        for col in range(second_test_mask.shape[1]):
-            if second_test_mask[row][col] == 1:
-                keypoints.append((row, col))
+    # an arc of n pixels covers at least n // 4 of the four first test pixels
+    min_count = FAST_FIRST_TEST_THRESHOLD if arc_length is None else arc_length // 4
+    first_test_mask = get_first_test_mask(img_level, threshold, border, min_count)
+    second_test_mask = get_second_test_mask(img_level, first_test_mask, threshold, arc_length)
+    keypoints = [tuple(keypoint) for keypoint in np.argwhere(second_test_mask == 1).tolist()]
     scores = calculate_kp_scores(img_level, keypoints)
     return keypoints, scores
 
 
-def pad_image(image: np.array, kernel_size: int) -> np.array:
-    """
-    This function performs zero padding using the number of
-    padding layers supplied as argument and return the padded
-    image.
-    """
-    padding_height = kernel_size - 1
-    padding_width = kernel_size - 1
-    pad_left = int(np.ceil(padding_width / 2))
-    # pad_right = int(np.floor(padding_width / 2))
-    pad_up = int(np.ceil(padding_height / 2))
-    # pad_down = int(np.floor(padding_height / 2))
-    padded_img = np.zeros((image.shape[0] + padding_height, image.shape[1] + padding_width))
-    padded_img[pad_up:pad_up + image.shape[0], pad_left:pad_left + image.shape[1]] = image
-    # padded_img = np.pad(image, [(pad_up, pad_down), (pad_left, pad_right)], mode='constant')
-    return padded_img
-
-
-def calculate_sum(image: np.array, kernel: np.array):
-    """
-        This function performs sum over an image and kernel.
-        """
-    sum_convolve = 0
-    for i in range(image.shape[0]):  # height
-        for j in range(image.shape[0]):  # width
-            sum_convolve += image[i][j] * kernel[i][j]
-    # if sum_convolve > 255:
-    #     sum_convolve = 255
-    # elif sum_convolve < 0:
-    #     sum_convolve = 0
-    return sum_convolve
-
-
-def apply_filter(image: np.array, kernel: np.array) -> np.array:
-    """
-    This function performs convolution over an image.
-    """
-    # A given image has to have either 2 (grayscale) or 3 (RGB) dimensions
-    assert image.ndim in [2, 3]
-    # A given filter has to be 2-dimensional and square
-    assert kernel.ndim == 2
-    assert kernel.shape[0] == kernel.shape[1]
-
-    if image.ndim == 2:  # Grayscale image
-        image_height, image_width = image.shape
-        # padded_image = pad_image(image.copy(), kernel.shape[0])
-        padded_image = image.copy()
-        convolved = np.zeros((image_height - 2, image_width - 2), dtype=image.dtype)
-
-        for i in range(image_height - 2):
-            for j in range(image_width - 2):
-                convolved[i, j] = calculate_sum(padded_image[i:i + kernel.shape[0], j:j + kernel.shape[0]], kernel)
-        convolved = pad_image(convolved.copy(), kernel.shape[0])
-    else:
-        raise ValueError("Input dimensions are not valid for convolution.")
-    return convolved
-
-
 def get_x_derivative(img_for_x: np.ndarray) -> np.ndarray:
     """
     Calculates x-derivative by applying separable Sobel filter.
@@ -289,15 +443,11 @@ def get_x_derivative(img_for_x: np.ndarray) -> np.ndarray:
     result : np.ndarray
         X-derivative of the input image.
     """
-    kernel_x = np.array([
-        [-1, 0, 1],
-        [-2, 0, 2],
-        [-1, 0, 1]]
-    )
     img_for_x = img_for_x.astype(int)
-    # convolved = convolve2d(img, kernel_x, mode='same', boundary='fill', fillvalue=0)
-
-    result = apply_filter(img_for_x, kernel_x)
+    result = np.zeros(img_for_x.shape)
+    # separable Sobel: [-1, 0, 1] along the rows, then [1, 2, 1] along the columns
+    diff = img_for_x[:, 2:] - img_for_x[:, :-2]
+    result[1:-1, 1:-1] = diff[:-2] + 2 * diff[1:-1] + diff[2:]
     return result
 
 
@@ -316,13 +466,11 @@ def get_y_derivative(img_for_y: np.ndarray) -> np.ndarray:
     result : np.ndarray
         Y-derivative of the input image.
     """
-    kernel_y = np.array([
-        [-1, -2, -1],
-        [0, 0, 0],
-        [1, 2, 1]]
-    )
     img_for_y = img_for_y.astype(int)
-    result = apply_filter(img_for_y, kernel_y)
+    result = np.zeros(img_for_y.shape)
+    # separable Sobel: [-1, 0, 1] along the columns, then [1, 2, 1] along the rows
+    diff = img_for_y[2:] - img_for_y[:-2]
+    result[1:-1, 1:-1] = diff[:, :-2] + 2 * diff[:, 1:-1] + diff[:, 2:]
     return result
 
 
@@ -331,7 +479,7 @@ def get_harris_response(img_harris: np.ndarray) -> np.ndarray:
     Calculates the Harris response.
 
     Calculates ixx, ixy and iyy from x and y-derivatives with Gaussian
-    windowing (utils.apply_gaussian_2d(data=..., sigma=1.0). Then, uses the
+    windowing (utils.apply_gaussian_2d_stack(data=..., sigma=1.0). Then, uses the
     computed matrices to calculate the determinant and trace of the second-
     moment matrix. From it, calculates the final Harris response.
 
@@ -347,21 +495,64 @@ def get_harris_response(img_harris: np.ndarray) -> np.ndarray:
     """
     dx, dy = get_x_derivative(img_harris), get_y_derivative(img_harris)
     dx, dy = dx.astype(float) / 255.0, dy.astype(float) / 255.0
-    ixx = dx * dx
-    ixy = dx * dy
-    iyy = dy * dy
-    ixx = apply_gaussian_2d(data=ixx, sigma=1.0)
-    ixy = apply_gaussian_2d(data=ixy, sigma=1.0)
-    iyy = apply_gaussian_2d(data=iyy, sigma=1.0)
+    # the three products are windowed together in one stacked Gaussian pass
+    ixx, ixy, iyy = apply_gaussian_2d_stack(data=np.stack([dx * dx, dx * dy, dy * dy]), sigma=HARRIS_SIGMA)
     det = ixx * iyy - ixy * ixy
     trace = ixx + iyy
     trace_sqrt = trace * trace
-    harris_response = det - 0.05 * trace_sqrt
+    harris_response = det - HARRIS_K * trace_sqrt
     return harris_response
 
 
+def get_harris_response_at(img_harris: np.ndarray, keypoints: List[Tuple[int, int]]) -> np.ndarray:
+    """
+    Calculates the Harris response only at the given keypoints.
+
+    Gives the values of get_harris_response() at the keypoints (up to floating
+    point rounding), but the derivatives and the Gaussian-weighted second-moment
+    matrix are computed only in the (2r+1)^2 window around every keypoint, r
+    being the Gaussian radius, so the cost grows with the number of keypoints
+    instead of the image area.
+
+    Parameters
+    ----------
+    img_harris : np.ndarray
+        Gray-scaled input image.
+    keypoints : List[Tuple[int, int]]
+        Keypoints as tuples of (row_idx, col_idx).
+
+    Returns
+    -------
+    harris_response : np.ndarray
+        Harris response at each of the keypoints.
+    """
+    weights, _ = get_gaussian_kernel(HARRIS_SIGMA)
+    radius = len(weights) // 2
+    rows, cols = np.asarray(keypoints, dtype=int).reshape(-1, 2).T
+    # the window grown by the Sobel halo, with zeros outside the image
+    offsets = np.arange(-radius - 1, radius + 2)
+    patch_rows, patch_cols = np.add.outer(rows, offsets)[:, :, np.newaxis], np.add.outer(cols, offsets)[:, np.newaxis, :]
+    inside = (patch_rows >= 0) & (patch_rows < img_harris.shape[0]) & (patch_cols >= 0) & (patch_cols < img_harris.shape[1])
+    patches = np.where(inside, img_harris[np.clip(patch_rows, 0, img_harris.shape[0] - 1),
+                                          np.clip(patch_cols, 0, img_harris.shape[1] - 1)].astype(int), 0)
+    diff = patches[:, :, 2:] - patches[:, :, :-2]
+    dx = diff[:, :-2] + 2 * diff[:, 1:-1] + diff[:, 2:]
+    diff = patches[:, 2:] - patches[:, :-2]
+    dy = diff[:, :, :-2] + 2 * diff[:, :, 1:-1] + diff[:, :, 2:]
+    # the derivatives are zero on the image border and outside of it, as in get_x_derivative()
+    window_rows = np.add.outer(rows, np.arange(-radius, radius + 1))
+    window_cols = np.add.outer(cols, np.arange(-radius, radius + 1))
+    valid = (((window_rows >= 1) & (window_rows < img_harris.shape[0] - 1))[:, :, np.newaxis]
+             & ((window_cols >= 1) & (window_cols < img_harris.shape[1] - 1))[:, np.newaxis, :])
+    dx, dy = np.where(valid, dx, 0) / 255.0, np.where(valid, dy, 0) / 255.0
+    ixx, ixy, iyy = (np.einsum('nij,i,j->n', product, weights, weights) for product in [dx * dx, dx * dy, dy * dy])
+    det = ixx * iyy - ixy * ixy
+    trace = ixx + iyy
+    return det - HARRIS_K * trace * trace
+
+
 def filter_keypoints(
-        img_filter: np.ndarray, keypoints: List[Tuple[int, int]], n_max_level: int
+        img_filter: np.ndarray, keypoints: List[Tuple[int, int]], n_max_level: int, mode: str = 'auto'
 ) -> List[Tuple[int, int]]:
     """
     Filters keypoints by Harris response.
@@ -378,24 +569,63 @@ def filter_keypoints(
         Initial FAST keypoints.
     n_max_level : int
         Maximal number of keypoints for a single pyramid level.
+    mode : str
+        'dense' reads the responses from get_harris_response() of the whole image,
+        'sparse' computes them only around the keypoints by get_harris_response_at(),
+        'auto' uses 'sparse' unless the keypoint windows together cover more than
+        HARRIS_SPARSE_MAX_COVERAGE of the image.
 
     Returns
     -------
     filtered_keypoints : List[Tuple[int, int]]
         Filtered FAST keypoints.
     """
-    keypoints_and_harris = []
-
-    harris_response = get_harris_response(img_filter)
-    for keypoint in keypoints:
-        keypoint_row, keypoint_col = keypoint
-        keypoints_and_harris.append((keypoint, harris_response[keypoint_row][keypoint_col]))
+    if mode not in ['auto', 'sparse', 'dense']:
+        raise ValueError(f"Unknown Harris response mode '{mode}'.")
+    if mode == 'auto':
+        window_size = len(get_gaussian_kernel(HARRIS_SIGMA)[0])
+        coverage = len(keypoints) * window_size ** 2 / max(img_filter.size, 1)
+        mode = 'sparse' if coverage <= HARRIS_SPARSE_MAX_COVERAGE else 'dense'
+    if mode == 'sparse':
+        responses = get_harris_response_at(img_filter, keypoints).tolist()
+    else:
+        harris_response = get_harris_response(img_filter)
+        responses = [harris_response[keypoint_row][keypoint_col] for keypoint_row, keypoint_col in keypoints]
+    keypoints_and_harris = list(zip(keypoints, responses))
 
     sorted_keypoints_harris = sorted(keypoints_and_harris, key=lambda x: x[1], reverse=True)
     filtered_keypoints = [keypoint[0] for keypoint in sorted_keypoints_harris[:n_max_level]]
     return filtered_keypoints
 
 
+def fast_level(
+        img_level: np.ndarray, threshold: int, border: int, n_max_level: int
+) -> List[Tuple[int, int]]:
+    """
+    Detects and filters the keypoints of a single pyramid level.
+
+    Parameters
+    ----------
+    img_level : np.ndarray
+        Image at the given level of the image pyramid.
+    threshold : int
+        Intensity by which tested pixel should differ from the pixels on its Bresenham circle.
+    border: int
+        Number of rows/columns at the image border where no keypoints should be reported.
+    n_max_level : int
+        Maximal number of keypoints for the level.
+
+    Returns
+    -------
+    keypoints : List[Tuple[int, int]]
+        Filtered FAST keypoints in the coordinates of the level.
+    """
+    keypoints, scores = detect_keypoints(img_level, threshold, border=border)
+    idxs = np.argsort(scores)[::-1]
+    keypoints = np.asarray(keypoints)[idxs][: 2 * n_max_level].tolist()
+    return filter_keypoints(img_level, keypoints, n_max_level)
+
+
 def fast(
         img_fast: np.ndarray,
         threshold: int = 20,
@@ -403,10 +633,14 @@ def fast(
         downscale_factor: float = 1.2,
         n_max_features: int = 500,
         border: int = 0,
+        workers: int = 1,
 ) -> List[List[Tuple[int, int]]]:
     """
     Applies the modified FAST detector.
 
+    The image pyramid comes from get_pyramid(), so calling fast() again on
+    the same image (e.g. with another threshold) reuses it.
+
     Parameters
     ----------
     img_fast : np.ndarray
@@ -419,8 +653,14 @@ def fast(
         Downscaling performed between successive pyramid layers.
     n_max_features : int
         Total maximal number of keypoints.
+    border: int
+        Number of rows/columns at the image border where no keypoints should be reported.
+    workers : int
+        Number of threads processing the pyramid levels concurrently. The levels
+        share the pyramid images, are started from the largest one and the
+        result is the same as with the default serial processing.
     """
-    pyr = create_pyramid(img_fast, n_pyr_levels, downscale_factor)
+    pyr = get_pyramid(img_fast, n_pyr_levels, downscale_factor)
     keypoints_pyr = []
     # Adapt Nmax for each level
     factor = 1.0 / downscale_factor
@@ -431,11 +671,17 @@ def fast(
         n_sum_levels += n_max_level[-1]
         n_per_level *= factor
     n_max_level[-1] = max(n_max_features - n_sum_levels, 0)
-    for level, img_level in enumerate(pyr):
-        keypoints, scores = detect_keypoints(img_level, threshold, border=border)
-        idxs = np.argsort(scores)[::-1]
-        keypoints = np.asarray(keypoints)[idxs][: 2 * n_max_level[level]].tolist()
-        keypoints = filter_keypoints(img_level, keypoints, n_max_level[level])
+    if workers > 1:
+        with ThreadPoolExecutor(workers) as executor:
+            # the largest levels take the longest, so they are started first
+            futures = {
+                level: executor.submit(fast_level, pyr[level], threshold, border, n_max_level[level])
+                for level in sorted(range(len(pyr)), key=lambda level: math.prod(pyr.shapes[level]), reverse=True)
+            }
+            levels_keypoints = [futures[level].result() for level in range(len(pyr))]
+    else:
+        levels_keypoints = [fast_level(img_level, threshold, border, n_max_level[level]) for level, img_level in enumerate(pyr)]
+    for level, keypoints in enumerate(levels_keypoints):
         upscale_factor = downscale_factor ** level
         keypoints = [
             (int(x * upscale_factor), int(y * upscale_factor)) for (x, y) in keypoints
@@ -6,7 +6,7 @@ import numpy as np
 # from scipy.spatial.distance import cdist
 from pathlib import Path
 
-from orb_detector import orb
+from orb_detector import orb, utils
 # from utils import apply_gaussian_2d
 import inspect
 from pylint.lint import Run
@@ -91,51 +91,92 @@ def test_create_pyramid(input_image, n_pyr_layers, downscale_factor):
         assert (pixels_ok / pixels_total) >= 0.9
 
 
-# Let student to solve detect_keypoints without helper mask arrays.
-# @pytest.mark.parametrize(
-#     "threshold,border", [[5, 0], [5, 10], [10, 0], [10, 20], [20, 0], [20, 20]]
-# )
-# def test_get_first_test_mask(input_image, threshold, border):
-#     img_base, img = input_image
-#     border = max(border, orb.FAST_CIRCLE_RADIUS)
-#     mask = orb.get_first_test_mask(img.astype(int), threshold, border)
-#     assert isinstance(mask, np.ndarray)
-#     assert mask.shape == img.shape
-#     assert mask[:border, :].sum() == 0
-#     assert mask[:, :border].sum() == 0
-#     assert mask[-border:, :].sum() == 0
-#     assert mask[:, -border:].sum() == 0
-#     mask_ref = np.load(REF_PATH / f"{img_base}_{threshold}_{border}_get_first_test_mask.npz")['mask_ref']
-#     x, y = img.shape
-#     assert (
-#         np.equal(mask, mask_ref).sum() / x / y > 0.98
-#     )  # might depend on dtype whether it is passed as int or np.uint8
-
-
-# Let student to solve detect_keypoints without helper mask arrays.
-# @pytest.mark.parametrize(
-#     "threshold,border", [[5, 0], [5, 10], [10, 0], [10, 20], [20, 0], [20, 20]]
-# )
-# def test_get_second_test_mask(input_image, threshold, border):
-#     img_base, img = input_image
-#     border = max(border, orb.FAST_CIRCLE_RADIUS)
-#     mask1 = orb.get_first_test_mask(img.astype(int), threshold, border)
-#     mask = orb.get_second_test_mask(img.astype(int), mask1, threshold)
-#     assert isinstance(mask, np.ndarray)
-#     assert mask.shape == img.shape
-#     assert mask[:border, :].sum() == 0
-#     assert mask[:, :border].sum() == 0
-#     assert mask[-border:, :].sum() == 0
-#     assert mask[:, -border:].sum() == 0
-#     mask_ref = np.load(REF_PATH / f"{img_base}_{threshold}_{border}_get_second_test_mask.npz")['mask_ref']
-#     x, y = img.shape
-#     assert (
-#         np.equal(mask, mask_ref).sum() / x / y > 0.98
-#     )  # might depend on dtype whether it is passed as int or np.uint8
+@pytest.mark.parametrize(
+    "n_pyr_layers,downscale_factor", [[1, 1.0], [2, 4.0], [3, 2.0], [5, 1.2]]
+)
+def test_pyramid(input_image, n_pyr_layers, downscale_factor):
+    _, img = input_image
+    pyr = orb.Pyramid(img, n_pyr_layers, downscale_factor)
+    assert len(pyr) == n_pyr_layers
+    assert [level.shape for level in pyr.levels()] == pyr.shapes
+    for level, level_ref in zip(pyr, orb.create_pyramid(img, n_pyr_layers, downscale_factor)):
+        assert np.array_equal(level, level_ref)
+        assert np.shares_memory(level, pyr.buffer)
+        assert not level.flags.writeable
+    cached = orb.get_pyramid(img, n_pyr_layers, downscale_factor)
+    assert orb.get_pyramid(img.copy(), n_pyr_layers, downscale_factor) is cached
+    assert orb.get_pyramid(img[::-1], n_pyr_layers, downscale_factor) is not cached
+    assert orb.get_pyramid(img, n_pyr_layers + 1, downscale_factor) is not cached
+
+
+@pytest.mark.parametrize(
+    "threshold,border", [[5, 0], [5, 10], [10, 0], [10, 20], [20, 0], [20, 20]]
+)
+def test_get_first_test_mask(input_image, threshold, border):
+    img_base, img = input_image
+    border = max(border, orb.FAST_CIRCLE_RADIUS)
+    mask = orb.get_first_test_mask(img.astype(int), threshold, border)
+    assert isinstance(mask, np.ndarray)
+    assert mask.shape == img.shape
+    assert mask[:border, :].sum() == 0
+    assert mask[:, :border].sum() == 0
+    assert mask[-border:, :].sum() == 0
+    assert mask[:, -border:].sum() == 0
+    mask_ref = np.load(REF_PATH / f"{img_base}_{threshold}_{border}_get_first_test_mask.npz")['mask_ref']
+    assert np.array_equal(mask, mask_ref)
+    assert np.array_equal(orb.get_first_test_mask(img, threshold, border), mask)
 
 
 @pytest.mark.parametrize(
-    "threshold,border", [[20, 20]]
+    "threshold,border", [[5, 0], [5, 10], [10, 0], [10, 20], [20, 0], [20, 20]]
+)
+def test_get_second_test_mask(input_image, threshold, border):
+    img_base, img = input_image
+    border = max(border, orb.FAST_CIRCLE_RADIUS)
+    mask1 = orb.get_first_test_mask(img.astype(int), threshold, border)
+    mask = orb.get_second_test_mask(img.astype(int), mask1, threshold)
+    assert isinstance(mask, np.ndarray)
+    assert mask.shape == img.shape
+    assert mask[:border, :].sum() == 0
+    assert mask[:, :border].sum() == 0
+    assert mask[-border:, :].sum() == 0
+    assert mask[:, -border:].sum() == 0
+    mask_ref = np.load(REF_PATH / f"{img_base}_{threshold}_{border}_get_second_test_mask.npz")['mask_ref']
+    assert np.array_equal(mask, mask_ref)
+    indices_ref = np.load(REF_PATH / f"{img_base}_{threshold}_{border}_get_second_test_mask_indices.npz")['mask_ref']
+    assert np.array_equal(mask[np.nonzero(mask1)], indices_ref)
+
+
+def test_arc_lookup_table():
+    for arc_length in [9, 12]:
+        table = orb.arc_lookup_table(arc_length)
+        assert table.shape == (orb.FAST_ARC_CODES,)
+        for code in [0, 0xFFFF, (1 << arc_length) - 1, (1 << arc_length) - 2, 0xFFFF >> (17 - arc_length)]:
+            bits = [(code >> i) & 1 for i in range(16)] * 2
+            assert table[code] == any(all(bits[start:start + arc_length]) for start in range(16))
+        wrapped = ((1 << 4) - 1) | (((1 << (arc_length - 4)) - 1) << (16 - arc_length + 4))
+        assert table[wrapped]
+
+
+@pytest.mark.parametrize("threshold", [10, 20])
+def test_get_second_test_mask_arc(input_image, threshold):
+    _, img = input_image
+    border = orb.FAST_CIRCLE_RADIUS
+    mask1 = orb.get_first_test_mask(img, threshold, border, min_count=9 // 4)
+    mask = orb.get_second_test_mask(img, mask1, threshold, arc_length=9)
+    detector = cv2.FastFeatureDetector_create(threshold, False, cv2.FAST_FEATURE_DETECTOR_TYPE_9_16)
+    mask_ref = np.zeros(img.shape, dtype=bool)
+    for kp in detector.detect(img):
+        row, col = round(kp.pt[1]), round(kp.pt[0])
+        if border <= row < img.shape[0] - border and border <= col < img.shape[1] - border:
+            mask_ref[row, col] = True
+    assert np.array_equal(mask.astype(bool), mask_ref)
+    keypoints, _ = orb.detect_keypoints(img, threshold, border, arc_length=9)
+    assert sorted(keypoints) == list(zip(*np.nonzero(mask_ref)))
+
+
+@pytest.mark.parametrize(
+    "threshold,border", [[10, 20], [20, 20], [20, 3]]
 )
 def test_calculate_kp_scores(input_image, threshold, border):
     img_base, img = input_image
@@ -213,6 +254,15 @@ def test_get_harris_response(input_image):
     assert np.allclose(response, response_ref)
 
 
+def test_apply_gaussian_2d_stack(input_image):
+    _, img = input_image
+    stack = np.stack([img / 255.0, np.sqrt(img / 255.0), (img / 255.0) ** 2])
+    result = utils.apply_gaussian_2d_stack(data=stack, sigma=1.0)
+    assert result.shape == stack.shape
+    for blurred, data in zip(result, stack):
+        assert np.allclose(blurred, utils.apply_gaussian_2d(data=data, sigma=1.0))
+
+
 @pytest.mark.parametrize(
     "n_max,threshold,border",
     [
@@ -239,3 +289,24 @@ def test_filter_keypoints(input_image, n_max, threshold, border):
         filtered_keypoints_ref[ind_ref],
     )
     assert np.array_equal(filtered_keypoints, filtered_keypoints_ref)
+
+
+@pytest.mark.parametrize("threshold,border", [[20, 3], [15, 10]])
+def test_get_harris_response_at(input_image, threshold, border):
+    img_base, img = input_image
+    keypoints = np.load(REF_PATH / f"{img_base}_{threshold}_{border}_detect_keypoints_1.npz")['keypoints_ref'].tolist()
+    keypoints += [(0, 0), (1, img.shape[1] - 1), (img.shape[0] - 2, 2)]
+    response = orb.get_harris_response_at(img, keypoints)
+    assert response.shape == (len(keypoints),)
+    response_ref = orb.get_harris_response(img)[tuple(np.asarray(keypoints).T)]
+    assert np.allclose(response, response_ref, rtol=1e-9, atol=1e-12)
+    assert orb.get_harris_response_at(img, []).shape == (0,)
+    n_max = len(keypoints) // 4
+    assert orb.filter_keypoints(img, keypoints, n_max, mode='sparse') == orb.filter_keypoints(img, keypoints, n_max, mode='dense')
+
+
+def test_fast_workers(input_image):
+    _, img = input_image
+    keypoints = orb.fast(img, threshold=20, n_pyr_levels=5, n_max_features=300)
+    assert len(keypoints) == 5
+    assert orb.fast(img, threshold=20, n_pyr_levels=5, n_max_features=300, workers=3) == keypoints
@@ -48,3 +48,16 @@ def apply_gaussian_2d(sigma, data):
     data_filtered_1d = apply_gaussian_1d(sigma, data, horizontal=True)
     data_filtered_2d = apply_gaussian_1d(sigma, data_filtered_1d, horizontal=False)
     return data_filtered_2d
+
+
+def apply_gaussian_2d_stack(sigma, data):
+    # Same as apply_gaussian_2d on every image of a (..., height, width) stack,
+    # all images at once: the zero padded stack is shifted by slicing and
+    # weighted by the kernel taps, first along the rows, then along the columns
+    kernel, _ = get_gaussian_kernel(sigma)
+    radius = len(kernel) // 2
+    height, width = data.shape[-2:]
+    padded = np.pad(data, [(0, 0)] * (data.ndim - 1) + [(radius, radius)])
+    data = sum(weight * padded[..., tap:tap + width] for tap, weight in enumerate(kernel))
+    padded = np.pad(data, [(0, 0)] * (data.ndim - 2) + [(radius, radius), (0, 0)])
+    return sum(weight * padded[..., tap:tap + height, :] for tap, weight in enumerate(kernel))